@@ -15,9 +15,10 @@ from nio import (
     InviteEvent,
     MatrixRoom,
     ReactionEvent,
+    RoomMemberEvent,
     RoomMessage,
 )
-from nio.responses import LoginResponse, SyncResponse
+from nio.responses import JoinResponse, LoginResponse, SyncResponse
 
 from bot_commands import CommandHandler
 from config import Config
@@ -30,30 +31,48 @@ from spotify_client import SpotifyClient
 logger = logging.getLogger(__name__)
 
 
+def _create_ssl_context() -> ssl.SSLContext:
+    """Build an SSL context backed by the certifi CA bundle (blocking I/O)."""
+    return ssl.create_default_context(cafile=certifi.where())
+
+
 class FMatrixBot:
     """Matrix bot for Last.fm stats and leaderboards."""
 
     def __init__(self, config_path=None):
         self.config = Config(config_path=config_path)
+        # Parsing the certifi CA bundle is costly; run() builds the context once
+        # (off the event loop) and it is shared by the Matrix client and the
+        # aiohttp connector
+        self._ssl_context: Optional[ssl.SSLContext] = None
         self.client: Optional[AsyncClient] = None
         self.db: Optional[Database] = None
-        self.lastfm = LastfmClient(
-            self.config.lastfm_api_key, self.config.lastfm_api_secret
-        )
-        self.discogs = None
-        if self.config.discogs_user_token:
-            self.discogs = DiscogsClient(self.config.discogs_user_token)
+        # Shared HTTP session (created in setup_client) so the homeserver
+        # probe, the Last.fm/Discogs/lyrics clients and image downloads reuse
+        # one connection pool.
+        self.http: Optional[aiohttp.ClientSession] = None
+        self.lastfm: Optional[LastfmClient] = None
+        self.discogs: Optional[DiscogsClient] = None
         self.spotify = None
         if self.config.spotify_client_id and self.config.spotify_client_secret:
             self.spotify = SpotifyClient(
                 self.config.spotify_client_id, self.config.spotify_client_secret
             )
-        self.lyrics = LyricsClient()
+        self.lyrics: Optional[LyricsClient] = None
         self.command_handler: Optional[CommandHandler] = None
+        # Set by the database when enough cache rows have accumulated
+        self._cleanup_event = asyncio.Event()
+        self._cleanup_task: Optional[asyncio.Task] = None
+        # Concrete event type -> handler (or None); filled lazily by dispatch_event
+        self._event_handlers: dict = {}
+        # Cached for the per-message fast path in message_callback
+        self._bot_user_id = self.config.matrix_user_id
+        self._prefix = self.config.command_prefix
+        self._prefix_char = self._prefix if len(self._prefix) == 1 else None
 
     async def init_db(self):
         """Initialize the database."""
-        self.db = Database(self.config.db_path)
+        self.db = Database(self.config.db_path, on_cache_full=self._cleanup_event.set)
         await self.db.init()
         logger.info("Database initialized")
 
@@ -63,29 +82,56 @@ class FMatrixBot:
             request_timeout=120,
             max_timeouts=10,
         )
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
         self.client = AsyncClient(
             self.config.matrix_homeserver,
             self.config.matrix_user_id,
             config=client_config,
-            ssl=ssl_context,
+            ssl=self._ssl_context,
         )
 
-        logger.info(f"Matrix client initialized for {self.config.matrix_user_id}")
+        connector = aiohttp.TCPConnector(
+            ssl=self._ssl_context,
+            limit=100,
+            # Cap per-host connections so one slow API can't drain the pool
+            limit_per_host=20,
+            ttl_dns_cache=300,
+            enable_cleanup_closed=True,
+            keepalive_timeout=75,
+        )
+        self.http = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=10)
+        )
+        self.lastfm = LastfmClient(
+            self.config.lastfm_api_key,
+            self.config.lastfm_api_secret,
+            session=self.http,
+        )
+        if self.config.discogs_user_token:
+            self.discogs = DiscogsClient(
+                self.config.discogs_user_token, session=self.http
+            )
+        self.lyrics = LyricsClient(session=self.http)
+
+        logger.info("Matrix client initialized for %s", self.config.matrix_user_id)
 
     async def check_homeserver(self):
         """Probe the homeserver to surface connectivity errors early."""
         url = f"{self.config.matrix_homeserver}/_matrix/client/versions"
-        timeout = aiohttp.ClientTimeout(total=10)
         try:
-            ssl_context = ssl.create_default_context(cafile=certifi.where())
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(url, ssl=ssl_context) as resp:
-                    logger.info(
-                        "Homeserver probe OK: %s (status %s)",
-                        url,
-                        resp.status,
-                    )
+            # The response body isn't used, so HEAD is enough
+            async with self.http.head(url) as resp:
+                status = resp.status
+            if status in (404, 405):
+                # Some homeservers don't route HEAD; fall back to GET and only
+                # read the first byte of the body
+                async with self.http.get(url) as resp:
+                    status = resp.status
+                    await resp.content.read(1)
+            logger.info(
+                "Homeserver probe OK: %s (status %s)",
+                url,
+                status,
+            )
         except Exception as e:
             logger.error("Homeserver probe failed: %s (%s)", url, e)
 
@@ -95,11 +141,11 @@ class FMatrixBot:
 
         if isinstance(login_response, LoginResponse):
             logger.info(
-                f"Logged in successfully. Device ID: {login_response.device_id}"
+                "Logged in successfully. Device ID: %s", login_response.device_id
             )
             return True
         else:
-            logger.error(f"Login failed: {login_response}")
+            logger.error("Login failed: %s", login_response)
             return False
 
     async def join_configured_rooms(self):
@@ -110,85 +156,140 @@ class FMatrixBot:
             )
             return
 
-        for room in self.config.auto_join_rooms:
-            try:
-                response = await self.client.join(room)
-                if hasattr(response, "room_id"):
-                    logger.info(f"Successfully joined room: {room}")
-                else:
-                    logger.error(f"Failed to join room {room}: {response}")
-            except Exception as e:
-                logger.error(f"Failed to join room {room}: {e}")
+        # Joins are independent requests, so issue them concurrently
+        rooms = self.config.auto_join_rooms
+        results = await asyncio.gather(
+            *(self.client.join(room) for room in rooms), return_exceptions=True
+        )
+        for room, response in zip(rooms, results):
+            if isinstance(response, JoinResponse):
+                logger.info("Successfully joined room: %s", room)
+            else:
+                logger.error("Failed to join room %s: %s", room, response)
 
     async def accept_pending_invites(self):
         """Accept all pending room invites."""
-        for room_id in list(self.client.invited_rooms):
-            try:
-                response = await self.client.join(room_id)
-                if hasattr(response, "room_id"):
-                    logger.info(f"Auto-accepted invite to room: {room_id}")
-                else:
-                    logger.error(f"Failed to accept invite to {room_id}: {response}")
-            except Exception as e:
-                logger.error(f"Failed to accept invite to {room_id}: {e}")
+        invited = self.client.invited_rooms
+        if not invited:
+            return
+        room_ids = tuple(invited)
+        results = await asyncio.gather(
+            *(self.client.join(room_id) for room_id in room_ids),
+            return_exceptions=True,
+        )
+        for room_id, response in zip(room_ids, results):
+            if isinstance(response, JoinResponse):
+                logger.info("Auto-accepted invite to room: %s", room_id)
+            else:
+                logger.error("Failed to accept invite to %s: %s", room_id, response)
 
     async def invite_callback(self, room: MatrixRoom, event: InviteEvent):
         """Handle room invites - auto-join any room we're invited to."""
         room_id = room.room_id
-        logger.info(f"Received invite to room: {room_id}")
+        logger.debug("Received invite to room: %s", room_id)
         try:
             response = await self.client.join(room_id)
-            if hasattr(response, "room_id"):
-                logger.info(f"Successfully joined room after invite: {room_id}")
+            if isinstance(response, JoinResponse):
+                logger.info("Successfully joined room after invite: %s", room_id)
             else:
-                logger.error(f"Failed to join invited room {room_id}: {response}")
+                logger.error("Failed to join invited room %s: %s", room_id, response)
         except Exception as e:
-            logger.error(f"Failed to join invited room {room_id}: {e}")
-
-    async def message_callback(self, room: MatrixRoom, event: RoomMessage):
-        """Handle incoming messages."""
-        try:
-            # Ignore messages from the bot itself
-            if event.sender == self.config.matrix_user_id:
-                return
-
-            # Check if message starts with command prefix
-            if not event.body.startswith(self.config.command_prefix):
+            logger.error("Failed to join invited room %s: %s", room_id, e)
+
+    async def message_callback(
+        self,
+        room: MatrixRoom,
+        event: RoomMessage,
+        _getattr=getattr,
+        _log=logger,
+    ):
+        """Handle incoming messages.
+
+        Builtins and the logger are bound as default arguments so the
+        per-message path uses fast local lookups instead of globals.
+        """
+        # Ignore messages from the bot itself and anything that isn't a
+        # command before doing any other work (this is the common case)
+        if event.sender == self._bot_user_id:
+            return
+        body = _getattr(event, "body", None)
+        if not body:
+            return
+        if self._prefix_char is not None:
+            if body[0] != self._prefix_char:
                 return
+        elif not body.startswith(self._prefix):
+            return
 
-            # Handle command
+        try:
             await self.command_handler.handle_command(
-                room=room, sender=event.sender, message=event.body, client=self.client
+                room=room, sender=event.sender, message=body, client=self.client
             )
-
         except Exception as e:
-            logger.error(f"Error handling message: {e}", exc_info=True)
+            _log.error("Error handling message: %s", e, exc_info=True)
 
-    async def reaction_callback(self, room: MatrixRoom, event: ReactionEvent):
+    async def reaction_callback(
+        self, room: MatrixRoom, event: ReactionEvent, _log=logger
+    ):
         """Handle reaction events for pagination."""
-        try:
-            logger.info(f"Reaction callback triggered - Sender: {event.sender}")
-            logger.info(f"Reacted to event: {event.reacts_to}, Key: {event.key}")
-
-            # Ignore reactions from the bot itself
-            if event.sender == self.config.matrix_user_id:
-                logger.info("Ignoring reaction from bot itself")
-                return
+        # Ignore reactions from the bot itself (e.g. its own pagination arrows)
+        if event.sender == self._bot_user_id:
+            return
 
-            # Handle the reaction
+        if _log.isEnabledFor(logging.DEBUG):
+            _log.debug(
+                "Reaction from %s on %s key=%s",
+                event.sender,
+                event.reacts_to,
+                event.key,
+            )
+        try:
             await self.command_handler.handle_reaction(
                 room=room, event=event, sender=event.sender, client=self.client
             )
-
         except Exception as e:
-            logger.error(f"Error handling reaction: {e}", exc_info=True)
+            _log.error("Error handling reaction: %s", e, exc_info=True)
+
+    async def member_callback(self, room: MatrixRoom, event: RoomMemberEvent):
+        """Forget the room's cached Last.fm mapping when its members change."""
+        # A leave and a join between commands keep the member count the
+        # command handler checks, so drop the mapping on every change
+        self.command_handler.forget_room_mapping(room.room_id)
+
+    async def dispatch_event(self, room: MatrixRoom, event):
+        """Route an event to its handler via a per-type lookup table."""
+        event_type = type(event)
+        try:
+            handler = self._event_handlers[event_type]
+        except KeyError:
+            # nio delivers concrete subclasses (RoomMessageText, ...), so
+            # resolve each type once by isinstance and remember the result
+            if issubclass(event_type, RoomMessage):
+                handler = self.message_callback
+            elif issubclass(event_type, InviteEvent):
+                handler = self.invite_callback
+            elif issubclass(event_type, ReactionEvent):
+                handler = self.reaction_callback
+            elif issubclass(event_type, RoomMemberEvent):
+                handler = self.member_callback
+            else:
+                handler = None
+            self._event_handlers[event_type] = handler
+        if handler is not None:
+            await handler(room, event)
 
     async def close(self):
         """Close all HTTP sessions and the database."""
-        await self.lastfm.close()
+        if self.command_handler:
+            await self.command_handler.close()
+        if self.lastfm:
+            await self.lastfm.close()
         if self.discogs:
             await self.discogs.close()
-        await self.lyrics.close()
+        if self.lyrics:
+            await self.lyrics.close()
+        if self.http:
+            await self.http.close()
         if self.db:
             await self.db.close()
         if self.client:
@@ -196,10 +297,22 @@ class FMatrixBot:
 
     async def run(self):
         """Run the bot."""
+        # Load the CA bundle in a worker thread while the database initializes
+        loop = asyncio.get_running_loop()
+        self._ssl_context, _ = await asyncio.gather(
+            loop.run_in_executor(None, _create_ssl_context),
+            self.init_db(),
+        )
         await self.setup_client()
         await self.check_homeserver()
         self.command_handler = CommandHandler(
-            self.db, self.lastfm, self.discogs, self.spotify, self.lyrics, self.config
+            self.db,
+            self.lastfm,
+            self.discogs,
+            self.spotify,
+            self.lyrics,
+            self.config,
+            http_session=self.http,
         )
 
         logged_in = await self.login()
@@ -211,31 +324,43 @@ class FMatrixBot:
         # Join configured rooms
         await self.join_configured_rooms()
 
-        # Accept any pending invites from before bot started
-        await self.accept_pending_invites()
-
-        # Start cache cleanup background task
-        asyncio.create_task(self.cache_cleanup_loop())
-
         logger.info("Starting sync loop...")
-        # Use custom sync loop to handle invites
+        # Run the sync loop and cache cleanup side by side; if either one stops
+        # (or fails) the other is cancelled and awaited before shutting down
+        sync_task = asyncio.create_task(
+            self.sync_with_invite_handling(), name="sync"
+        )
+        self._cleanup_task = asyncio.create_task(
+            self.cache_cleanup_loop(), name="cache-cleanup"
+        )
+        tasks = (sync_task, self._cleanup_task)
         try:
-            await self.sync_with_invite_handling()
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
         finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
             await self.close()
         return True
 
     async def cache_cleanup_loop(self):
-        """Periodically clean up old cache entries."""
+        """Clean up old cache entries hourly, or sooner when the cache fills up."""
         runs = 0
         while True:
             try:
-                # Wait 1 hour between cleanups
-                await asyncio.sleep(3600)
+                try:
+                    await asyncio.wait_for(self._cleanup_event.wait(), timeout=3600)
+                except asyncio.TimeoutError:
+                    pass
+                # Sweep on every wake-up: rows written before the last sweep
+                # go stale after it, so a quiet hour still has rows to expire.
+                # The write counter only sets the event for an early run.
+                self._cleanup_event.clear()
+
                 logger.info("Running cache cleanup...")
-                await self.db.clear_old_cache(max_age_hours=24)
-                await self.db.clear_old_playcount_cache(max_age_hours=24)
-                await self.db.clear_old_auth_tokens(max_age_hours=24)
+                await self.db.clear_all_old(max_age_hours=24)
                 runs += 1
                 if runs % 24 == 0:
                     await self.db.optimize()
@@ -243,31 +368,34 @@ class FMatrixBot:
             except asyncio.CancelledError:
                 raise
             except Exception as e:
-                logger.error(f"Error during cache cleanup: {e}", exc_info=True)
+                logger.error("Error during cache cleanup: %s", e, exc_info=True)
 
     async def sync_with_invite_handling(self):
         """Sync loop that handles room invites automatically."""
         # First sync: establish sync token without processing events
         logger.info("Initial sync - establishing connection...")
         initial_sync = await self.client.sync(timeout=30000)
+        if not isinstance(initial_sync, SyncResponse):
+            logger.warning("Initial sync failed: %s", initial_sync)
 
-        # NOW set up event handlers after we have the sync token
-        self.client.add_event_callback(self.message_callback, RoomMessage)
-
-        # Add callback for room invites to auto-join
-        self.client.add_event_callback(self.invite_callback, InviteEvent)
+        # Accept any pending invites from before bot started; later invites
+        # are handled by invite_callback
+        await self.accept_pending_invites()
 
-        # Add callback for reactions (pagination)
-        self.client.add_event_callback(self.reaction_callback, ReactionEvent)
+        # NOW set up event handlers after we have the sync token. A single
+        # callback is registered so nio does one isinstance check per event;
+        # dispatch_event routes it to the message, invite, reaction or
+        # membership handler.
+        self.client.add_event_callback(
+            self.dispatch_event,
+            (RoomMessage, InviteEvent, ReactionEvent, RoomMemberEvent),
+        )
 
         logger.info("Bot ready - processing new messages only")
-        while True:
-            # Check for new invites before syncing
-            await self.accept_pending_invites()
-
-            # Sync with new messages only (10 second timeout for fast message polling)
-            sync_response = await self.client.sync(timeout=10000)
-
-            if not isinstance(sync_response, SyncResponse):
-                logger.warning(f"Sync failed: {sync_response}")
-                continue
+        # Long-poll with a 10 second timeout; the server answers as soon as an
+        # event arrives, so idle rooms only cost one request per timeout and
+        # no adaptive backoff is needed. nio dispatches the registered
+        # callbacks for every sync response.
+        await self.client.sync_forever(
+            timeout=10000, full_state=False, loop_sleep_time=0
+        )
@@ -2,13 +2,16 @@ from __future__ import annotations
 
 """Shared base utilities and state for split bot command handlers."""
 
+import asyncio
 import logging
 import os
 import re
 import time
+from collections import OrderedDict
 from difflib import SequenceMatcher
 from io import BytesIO
-from typing import Any, Callable, Dict, Optional
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, Optional
 
 import aiohttp
 from nio import AsyncClient, MatrixRoom
@@ -21,13 +24,110 @@ from lastfm_client import LastfmClient
 
 logger = logging.getLogger(__name__)
 
+# Command abbreviations
+_COMMAND_ALIASES = MappingProxyType(
+    {
+        "fm": "lastfm",
+        "lastfm": "lastfm",
+        "ta": "topalbums",
+        "tb": "topalbums",
+        "tt": "toptracks",
+        "tar": "topartists",
+        "wk": "whoknows",
+        "whoknows": "whoknows",
+        "wkt": "whoknowstrack",
+        "whoknowstrack": "whoknowstrack",
+        "wka": "whoknowsalbum",
+        "whoknowsalbum": "whoknowsalbum",
+        "c": "chart",
+        "chart": "chart",
+        "lb": "leaderboard",
+        "r": "recent",
+        "s": "stats",
+        "l": "link",
+        "?": "help",
+        "discogs": "discogs",
+        "dg": "discogs",
+        "dgc": "dgcollection",
+        "dgw": "dgwantlist",
+        "spotify": "spotify",
+        "sp": "spotify",
+        "lyrics": "lyrics",
+        "ly": "lyrics",
+    }
+)
+
+# One-character aliases in either case, so the common single-letter
+# commands skip case folding
+_SINGLE_CHAR_ALIASES = MappingProxyType(
+    {
+        key: value
+        for alias, value in _COMMAND_ALIASES.items()
+        if len(alias) == 1
+        for key in {alias, alias.upper()}
+    }
+)
+
+# Period abbreviations
+_PERIOD_ALIASES = MappingProxyType(
+    {
+        "7d": "7days",
+        "7day": "7days",
+        "1m": "1month",
+        "1month": "1month",
+        "3m": "3month",
+        "3month": "3month",
+        "6m": "6month",
+        "6month": "6month",
+        "12m": "12month",
+        "1y": "overall",
+        "y": "overall",
+        "all": "overall",
+    }
+)
+
+# Valid periods for Last.fm API, in display order
+_VALID_PERIODS_DISPLAY = ("overall", "12month", "6month", "3month", "1month", "7days")
+_VALID_PERIODS = frozenset(_VALID_PERIODS_DISPLAY)
+_VALID_PERIODS_STR = ", ".join(_VALID_PERIODS_DISPLAY)
+
+# Period display names
+_PERIOD_NAMES = MappingProxyType(
+    {
+        "overall": "All Time",
+        "12month": "Last 12 Months",
+        "6month": "Last 6 Months",
+        "3month": "Last 3 Months",
+        "1month": "Last Month",
+        "7days": "Last 7 Days",
+    }
+)
+
+# Fuzzy matching keeps only lowercase letters and digits
+_FUZZY_STRIP_RE = re.compile(r"[^a-z0-9]+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Any character from the basic Cyrillic block
+_CYRILLIC_RE = re.compile("[\u0400-\u04FF]")
+
 
 class PaginationManager:
     """Manages paginated messages with reaction-based navigation."""
 
+    # Paginations older than this are dropped by cleanup_old
+    MAX_AGE_SECONDS = 3600
+
+    # Rendered pages kept per pagination for back-and-forth navigation
+    PAGE_CACHE_SIZE = 10
+
+    # Cached pages older than this are rendered again, so a pagination that
+    # stays in use doesn't keep serving stale data
+    PAGE_CACHE_TTL_SECONDS = 300
+
     def __init__(self):
-        # Store pagination state: event_id -> {room_id, user_id, current_page, total_pages, callback, reaction_event_ids}
-        self.paginations: Dict[str, Dict[str, Any]] = {}
+        # Store pagination state: event_id -> {room_id, user_id, current_page, total_pages, callback, page_cache, reaction_event_ids, created_at}
+        # Kept in registration order, so the oldest entries are always first
+        self.paginations: OrderedDict[str, Dict[str, Any]] = OrderedDict()
 
     def register(
         self,
@@ -37,21 +137,45 @@ class PaginationManager:
         current_page: int,
         total_pages: int,
         callback: Callable,
+        page_cache: Optional[Dict[int, tuple[float, str]]] = None,
     ):
-        """Register a paginated message."""
+        """Register a paginated message.
+
+        page_cache seeds the rendered pages as page -> (time.monotonic() when
+        rendered, content), e.g. with the page just sent.
+        """
+        self.cleanup_old()
         self.paginations[event_id] = {
             "room_id": room_id,
             "user_id": user_id,
             "current_page": current_page,
             "total_pages": total_pages,
             "callback": callback,
+            # page -> (rendered_at, content), LRU-ordered, see render_page
+            "page_cache": OrderedDict(page_cache or ()),
             "reaction_event_ids": [],  # Store reaction event IDs for later removal
+            "created_at": time.monotonic(),
         }
 
     def get(self, event_id: str) -> Optional[Dict[str, Any]]:
         """Get pagination state for an event."""
         return self.paginations.get(event_id)
 
+    async def render_page(self, pagination: Dict[str, Any], page: int) -> str:
+        """Return a page's content, reusing it if it was rendered recently."""
+        cache = pagination["page_cache"]
+        now = time.monotonic()
+        hit = cache.get(page)
+        if hit is not None and now - hit[0] < self.PAGE_CACHE_TTL_SECONDS:
+            cache.move_to_end(page)
+            return hit[1]
+        content = await pagination["callback"](page)
+        cache[page] = (now, content)
+        cache.move_to_end(page)
+        if len(cache) > self.PAGE_CACHE_SIZE:
+            cache.popitem(last=False)
+        return content
+
     def update_page(self, event_id: str, new_page: int):
         """Update the current page for a pagination."""
         if event_id in self.paginations:
@@ -77,74 +201,36 @@ class PaginationManager:
         """Remove a pagination."""
         self.paginations.pop(event_id, None)
 
-    def cleanup_old(self, max_age_seconds: int = 3600):
-        """Remove old paginations (if needed in future)."""
-        # For now, we'll keep them until explicitly removed
-        pass
+    def cleanup_old(self, max_age_seconds: int = MAX_AGE_SECONDS):
+        """Remove paginations registered more than max_age_seconds ago."""
+        cutoff = time.monotonic() - max_age_seconds
+        paginations = self.paginations
+        # Registration order means only the stale prefix needs to be visited
+        while paginations:
+            if next(iter(paginations.values()))["created_at"] >= cutoff:
+                break
+            paginations.popitem(last=False)
 
 
 class CommandHandlerBase:
     """Handles commands from Matrix messages."""
 
-    # Command abbreviations
-    COMMAND_ALIASES = {
-        "fm": "lastfm",
-        "lastfm": "lastfm",
-        "ta": "topalbums",
-        "tb": "topalbums",
-        "tt": "toptracks",
-        "tar": "topartists",
-        "wk": "whoknows",
-        "whoknows": "whoknows",
-        "wkt": "whoknowstrack",
-        "whoknowstrack": "whoknowstrack",
-        "wka": "whoknowsalbum",
-        "whoknowsalbum": "whoknowsalbum",
-        "c": "chart",
-        "chart": "chart",
-        "lb": "leaderboard",
-        "r": "recent",
-        "s": "stats",
-        "l": "link",
-        "?": "help",
-        "discogs": "discogs",
-        "dg": "discogs",
-        "dgc": "dgcollection",
-        "dgw": "dgwantlist",
-        "spotify": "spotify",
-        "sp": "spotify",
-        "lyrics": "lyrics",
-        "ly": "lyrics",
-    }
+    # Command abbreviations, period abbreviations, valid periods and period
+    # display names; read-only views of the module-level tables
+    COMMAND_ALIASES = _COMMAND_ALIASES
+    PERIOD_ALIASES = _PERIOD_ALIASES
+    VALID_PERIODS_DISPLAY = _VALID_PERIODS_DISPLAY
+    VALID_PERIODS = _VALID_PERIODS
+    PERIOD_NAMES = _PERIOD_NAMES
 
-    # Period abbreviations
-    PERIOD_ALIASES = {
-        "7d": "7days",
-        "7day": "7days",
-        "1m": "1month",
-        "1month": "1month",
-        "3m": "3month",
-        "3month": "3month",
-        "6m": "6month",
-        "6month": "6month",
-        "12m": "12month",
-        "1y": "overall",
-        "y": "overall",
-        "all": "overall",
-    }
+    # Upper bound on in-memory Last.fm responses kept by _cached
+    RESPONSE_CACHE_MAX_ENTRIES = 1024
 
-    # Valid periods for Last.fm API
-    VALID_PERIODS = ["overall", "12month", "6month", "3month", "1month", "7days"]
+    # How long a room's Matrix -> Last.fm user mapping is reused
+    ROOM_MAPPING_TTL_SECONDS = 30
 
-    # Period display names
-    PERIOD_NAMES = {
-        "overall": "All Time",
-        "12month": "Last 12 Months",
-        "6month": "Last 6 Months",
-        "3month": "Last 3 Months",
-        "1month": "Last Month",
-        "7days": "Last 7 Days",
-    }
+    # Most queued messages whose reactions _reaction_worker sends together
+    REACTION_BATCH_SIZE = 8
 
     def __init__(
         self,
@@ -154,6 +240,7 @@ class CommandHandlerBase:
         spotify,
         lyrics,
         config: Config,
+        http_session: Optional[aiohttp.ClientSession] = None,
     ):
         self.db = db
         self.lastfm = lastfm
@@ -161,19 +248,72 @@ class CommandHandlerBase:
         self.spotify = spotify
         self.lyrics = lyrics
         self.config = config
+        # Shared session for image downloads; owned and closed by the bot
+        self._http = http_session
+        self._prefix = config.command_prefix
+        # The prefix followed by the command token, see handle_command
+        self._command_re = re.compile(re.escape(self._prefix) + r"\s*(\S+)")
         self.pagination = PaginationManager()
+        # Built on first use by show_help / show_discogs_help; the prefix and
+        # integrations are fixed
+        self._help_text: Optional[str] = None
+        self._discogs_help_text: Optional[str] = None
+        # Server name used to qualify bare user IDs, see _homeserver_domain
+        self._homeserver: Optional[str] = None
+        # room_id -> (fetched_at, member_count, {matrix_user: lastfm_user})
+        self._room_mapping_cache: Dict[str, tuple[float, int, Dict[str, str]]] = {}
         self._now_playing_cache: Dict[str, Dict[str, Any]] = {}
         self._now_playing_ttl_seconds = 10
+        # (kind, *params) -> (fetched_at, value); LRU-ordered, see _cached
+        self._response_cache: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        # key -> in-flight fetch shared by concurrent callers, see _single_flight
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        # Caps concurrent Last.fm calls across all commands, see _bounded
+        self._lastfm_sem = asyncio.Semaphore(config.lastfm_concurrency or 8)
+        # (client, room_id, content) reactions waiting to be sent; the
+        # worker is started by _queue_pagination_reactions on first use
+        self._reaction_queue: Optional[asyncio.Queue] = None
+        self._reaction_worker_task: Optional[asyncio.Task] = None
+        # Normalized command -> bound handler, see CommandRouterMixin
+        (
+            self._root_handlers,
+            self._lastfm_handlers,
+            self._discogs_handlers,
+        ) = self._build_dispatch_tables()
+
+    async def close(self):
+        """Stop the background reaction worker, if it was started."""
+        task = self._reaction_worker_task
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def _homeserver_domain(self, client: AsyncClient) -> str:
+        """Return the homeserver's domain, derived once from the client URL."""
+        if self._homeserver is None:
+            self._homeserver = client.homeserver.split("https://")[-1]
+        return self._homeserver
 
     @staticmethod
     def normalize_command(cmd: str) -> str:
         """Convert command abbreviations to full names."""
-        return CommandHandlerBase.COMMAND_ALIASES.get(cmd.lower(), cmd.lower())
+        if len(cmd) == 1:
+            return _SINGLE_CHAR_ALIASES.get(cmd) or cmd.lower()
+        # Commands are almost always typed in lowercase already
+        if not cmd.islower():
+            cmd = cmd.lower()
+        return _COMMAND_ALIASES.get(cmd, cmd)
 
     @staticmethod
     def normalize_period(period: str) -> str:
         """Convert period abbreviations to full names."""
-        return CommandHandlerBase.PERIOD_ALIASES.get(period.lower(), period.lower())
+        if not period.islower():
+            period = period.lower()
+        return _PERIOD_ALIASES.get(period, period)
 
     async def _get_target_user(
         self, room: MatrixRoom, sender: str, client: AsyncClient, args: list = None
@@ -182,6 +322,16 @@ class CommandHandlerBase:
         if args and args[0]:
             return args[0]
 
+        # Reuse a fresh room mapping from a recent whoknows/leaderboard
+        # before going to the database
+        hit = self._room_mapping_cache.get(room.room_id)
+        if (
+            hit is not None
+            and sender in hit[2]
+            and time.monotonic() - hit[0] < self.ROOM_MAPPING_TTL_SECONDS
+        ):
+            return hit[2][sender]
+
         target_user = await self.db.get_lastfm_username(sender)
         if not target_user:
             await self.send_message(
@@ -191,43 +341,158 @@ class CommandHandlerBase:
             )
         return target_user
 
+    async def _get_http_session(self) -> aiohttp.ClientSession:
+        """Get the shared HTTP session, falling back to the Last.fm client's."""
+        if self._http is not None and not self._http.closed:
+            return self._http
+        return await self.lastfm.get_session()
+
+    async def _get_room_mapping(self, room: MatrixRoom) -> Dict[str, str]:
+        """Get the Last.fm usernames of linked room members, cached briefly.
+
+        A change in the room's member count invalidates the cached entry.
+        """
+        room_id = room.room_id
+        member_count = len(room.users)
+        now = time.monotonic()
+        hit = self._room_mapping_cache.get(room_id)
+        if (
+            hit is not None
+            and hit[1] == member_count
+            and now - hit[0] < self.ROOM_MAPPING_TTL_SECONDS
+        ):
+            return hit[2]
+
+        mapping = await self.db.get_all_users_in_room(room_id, list(room.users))
+        self._room_mapping_cache[room_id] = (now, member_count, mapping)
+        return mapping
+
     async def _validate_period(
         self, room: MatrixRoom, period: str, client: AsyncClient
     ) -> bool:
         """Validate and send error if period is invalid. Returns True if valid."""
-        if period in self.VALID_PERIODS:
+        if period in _VALID_PERIODS:
             return True
 
         await self.send_message(
             room,
-            f"❌ Invalid period '{period}'. Valid options: {', '.join(self.VALID_PERIODS)}",
+            f"❌ Invalid period '{period}'. Valid options: {_VALID_PERIODS_STR}",
             client,
         )
         return False
 
+    async def _cached(
+        self, key: tuple, ttl: float, fetcher: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Return a cached Last.fm response for key, fetching it when stale.
+
+        Empty responses (None, []) aren't cached so failures are retried.
+        """
+        cache = self._response_cache
+        entry = cache.get(key)
+        now = time.monotonic()
+        if entry is not None and now - entry[0] < ttl:
+            cache.move_to_end(key)
+            return entry[1]
+
+        value = await self._single_flight(key, fetcher)
+        if value:
+            cache[key] = (now, value)
+            cache.move_to_end(key)
+            if len(cache) > self.RESPONSE_CACHE_MAX_ENTRIES:
+                cache.popitem(last=False)
+        return value
+
+    def forget_room_mapping(self, room_id: str):
+        """Drop a room's cached Last.fm mapping, e.g. after a membership change."""
+        self._room_mapping_cache.pop(room_id, None)
+
+    def _clear_cached(self, kind: str):
+        """Drop every cached response of one kind, e.g. after a write."""
+        cache = self._response_cache
+        for key in [key for key in cache if key[0] == kind]:
+            del cache[key]
+
+    async def _single_flight(
+        self, key: tuple, fetcher: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Run fetcher once for concurrent callers with the same key.
+
+        Callers arriving while a fetch is in flight await its result
+        instead of issuing a duplicate request.
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetcher())
+            self._inflight[key] = future
+
+            def _done(fut: asyncio.Future, key=key) -> None:
+                self._inflight.pop(key, None)
+                # Mark the exception retrieved if every caller was cancelled
+                if not fut.cancelled():
+                    fut.exception()
+
+            future.add_done_callback(_done)
+        # shield: one caller being cancelled mustn't cancel the shared fetch
+        return await asyncio.shield(future)
+
+    async def _gather_lastfm(self, coros) -> list:
+        """Run per-user Last.fm coroutines concurrently, bounded by config.
+
+        The bound is shared by all commands, so concurrent whoknows or
+        leaderboard runs don't multiply the load on Last.fm.
+
+        Exceptions are returned in place of results so one failing user
+        doesn't abort the batch.
+        """
+        return await asyncio.gather(
+            *(self._bounded(coro) for coro in coros), return_exceptions=True
+        )
+
+    async def _bounded(self, coro: Awaitable[Any]) -> Any:
+        """Await a Last.fm call under the handler-wide concurrency limit."""
+        async with self._lastfm_sem:
+            return await coro
+
     @staticmethod
     def _extract_artist_name(artist) -> str:
         """Extract artist name from dict or string."""
-        if isinstance(artist, dict):
+        # Parsed JSON only ever yields plain dicts, so skip isinstance's
+        # subclass check
+        if type(artist) is dict:
             # Last.fm API uses both 'name' and '#text' fields
             return artist.get("name") or artist.get("#text", "Unknown")
         return str(artist) if artist else "Unknown"
 
+    @staticmethod
+    def _artist_name_from_dict(artist: dict) -> str:
+        """Fast path of _extract_artist_name for Last.fm list rows, whose
+        artist field is always a dict."""
+        return artist.get("name") or artist.get("#text") or "Unknown"
+
     @staticmethod
     def _normalize_fuzzy_text(text: str) -> str:
         if not text:
             return ""
-        return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+        return _FUZZY_STRIP_RE.sub(" ", text.lower()).strip()
 
     @staticmethod
     def _normalize_cache_text(text: str) -> str:
         if not text:
             return ""
-        return re.sub(r"\s+", " ", text.strip().lower())
+        return _WHITESPACE_RE.sub(" ", text.strip().lower())
 
     @classmethod
     def _fuzzy_ratio(cls, left: str, right: str) -> float:
-        left_norm = cls._normalize_fuzzy_text(left)
+        return cls._fuzzy_ratio_normalized(cls._normalize_fuzzy_text(left), right)
+
+    @classmethod
+    def _fuzzy_ratio_normalized(cls, left_norm: str, right: str) -> float:
+        """Like _fuzzy_ratio, with the left side already normalized.
+
+        Lets the result selectors normalize the query once per search
+        instead of once per candidate.
+        """
         right_norm = cls._normalize_fuzzy_text(right)
         if not left_norm or not right_norm:
             return 0.0
@@ -244,7 +509,7 @@ class CommandHandlerBase:
     def _contains_cyrillic(text: str) -> bool:
         if not text:
             return False
-        return any(0x0400 <= ord(ch) <= 0x04FF for ch in text)
+        return _CYRILLIC_RE.search(text) is not None
 
     @staticmethod
     def _is_truetype_font(font: ImageFont.ImageFont) -> bool:
@@ -356,11 +621,7 @@ class CommandHandlerBase:
 
     def _lastfm_candidate_text(self, result: Dict[str, Any], kind: str) -> str:
         name = result.get("name", "")
-        if kind == "track":
-            artist_name = self._extract_artist_name(result.get("artist", {}))
-            if artist_name:
-                return f"{artist_name} - {name}".strip()
-        if kind == "album":
+        if kind == "track" or kind == "album":
             artist_name = self._extract_artist_name(result.get("artist", {}))
             if artist_name:
                 return f"{artist_name} - {name}".strip()
@@ -378,17 +639,18 @@ class CommandHandlerBase:
         if not results:
             return None
 
-        max_popularity = max(
-            (self._get_lastfm_popularity(r) for r in results), default=0
-        )
+        # Score each result's popularity once; it's needed for the max and
+        # again per candidate
+        popularities = [self._get_lastfm_popularity(r) for r in results]
+        max_popularity = max(popularities, default=0)
         best_result = None
         best_score = -1.0
         best_similarity = -1.0
+        query_norm = self._normalize_fuzzy_text(query)
 
-        for result in results:
+        for result, popularity in zip(results, popularities):
             candidate = self._lastfm_candidate_text(result, kind)
-            similarity = self._fuzzy_ratio(query, candidate)
-            popularity = self._get_lastfm_popularity(result)
+            similarity = self._fuzzy_ratio_normalized(query_norm, candidate)
             popularity_score = (popularity / max_popularity) if max_popularity else 0.0
             score = (similarity * 0.75) + (popularity_score * 0.25)
 
@@ -415,17 +677,16 @@ class CommandHandlerBase:
         if not results:
             return None
 
-        max_popularity = max(
-            (self._get_discogs_popularity(r) for r in results), default=0
-        )
+        popularities = [self._get_discogs_popularity(r) for r in results]
+        max_popularity = max(popularities, default=0)
         best_result = None
         best_score = -1.0
         best_similarity = -1.0
+        query_norm = self._normalize_fuzzy_text(query)
 
-        for result in results:
+        for result, popularity in zip(results, popularities):
             title = result.get("title", "")
-            similarity = self._fuzzy_ratio(query, title)
-            popularity = self._get_discogs_popularity(result)
+            similarity = self._fuzzy_ratio_normalized(query_norm, title)
             popularity_score = (popularity / max_popularity) if max_popularity else 0.0
             score = (similarity * 0.8) + (popularity_score * 0.2)
 
@@ -448,13 +709,14 @@ class CommandHandlerBase:
         best_result = None
         best_score = -1.0
         best_similarity = -1.0
+        query_norm = self._normalize_fuzzy_text(query)
 
         for result in results:
             # Build candidate text from track name and artist names
             track_name = result.get("name", "")
             artists = [artist.get("name", "") for artist in result.get("artists", [])]
             candidate = f"{track_name} {' '.join(artists)}"
-            similarity = self._fuzzy_ratio(query, candidate)
+            similarity = self._fuzzy_ratio_normalized(query_norm, candidate)
 
             # Spotify doesn't have popularity in the same way, so just use similarity
             if similarity > best_score or (
@@ -480,7 +742,7 @@ class CommandHandlerBase:
 
     def _get_period_name(self, period: str) -> str:
         """Get display name for a period."""
-        return self.PERIOD_NAMES.get(period, period)
+        return _PERIOD_NAMES.get(period, period)
 
 
 CommandHandler = CommandHandlerBase
@@ -1,30 +1,48 @@
 from __future__ import annotations
 
+import re
+
 from nio import AsyncClient, MatrixRoom
 
+_SLUG_INVALID_RE = re.compile(r'[^\w\-]+')
+_SLUG_DASHES_RE = re.compile(r'-+')
+
+
+def _slugify(text: str) -> str:
+    """Turn a release title into a Discogs URL slug."""
+    slug = _SLUG_INVALID_RE.sub('-', text)
+    slug = _SLUG_DASHES_RE.sub('-', slug)
+    return slug.strip('-')
+
 
 class DiscogsCommandsMixin:
-    async def show_discogs_help(self, room: MatrixRoom, client: AsyncClient):
-        """Show Discogs help message."""
-        help_text = f"""
+    # Discogs help text; {prefix} is the command prefix
+    _DISCOGS_HELP_TEMPLATE = """
 **Discogs Commands:**
 
-`{self.config.command_prefix}discogs link <username>` (dg link) - Link Discogs account
-`{self.config.command_prefix}discogs stats [username]` (dg stats) - Show collection/wantlist stats
-`{self.config.command_prefix}discogs collection [username] [page]` (dg collection) - Show collection items
-`{self.config.command_prefix}discogs wantlist [username] [page]` (dg wantlist) - Show wantlist items
-`{self.config.command_prefix}discogs search <query>` (dg search) - Search Discogs database
-`{self.config.command_prefix}discogs artist <name>` (dg artist) - Search for artist info
-`{self.config.command_prefix}discogs release <name>` (dg release) - Search for release info
-`{self.config.command_prefix}discogs help` (dg help) - Show this help
+`{prefix}discogs link <username>` (dg link) - Link Discogs account
+`{prefix}discogs stats [username]` (dg stats) - Show collection/wantlist stats
+`{prefix}discogs collection [username] [page]` (dg collection) - Show collection items
+`{prefix}discogs wantlist [username] [page]` (dg wantlist) - Show wantlist items
+`{prefix}discogs search <query>` (dg search) - Search Discogs database
+`{prefix}discogs artist <name>` (dg artist) - Search for artist info
+`{prefix}discogs release <name>` (dg release) - Search for release info
+`{prefix}discogs help` (dg help) - Show this help
 
 **Examples:**
-`{self.config.command_prefix}dg link MyDiscogsUsername`
-`{self.config.command_prefix}dg stats`
-`{self.config.command_prefix}dg collection`
-`{self.config.command_prefix}dg search Pink Floyd`
+`{prefix}dg link MyDiscogsUsername`
+`{prefix}dg stats`
+`{prefix}dg collection`
+`{prefix}dg search Pink Floyd`
         """
-        await self.send_message(room, help_text, client)
+
+    async def show_discogs_help(self, room: MatrixRoom, client: AsyncClient):
+        """Show Discogs help message."""
+        if self._discogs_help_text is None:
+            self._discogs_help_text = self._DISCOGS_HELP_TEMPLATE.format(
+                prefix=self.config.command_prefix
+            )
+        await self.send_message(room, self._discogs_help_text, client)
 
     async def link_discogs_user(self, room: MatrixRoom, sender: str, args: list, client: AsyncClient):
         """Link a Matrix user to a Discogs account."""
@@ -162,13 +180,7 @@ class DiscogsCommandsMixin:
                 format_display = format_emoji.get(format_name, '🎵')
 
                 # Create Discogs URL
-                def slugify(text):
-                    import re
-                    slug = re.sub(r'[^\w\-]+', '-', text)
-                    slug = re.sub(r'-+', '-', slug)
-                    return slug.strip('-')
-
-                slug = slugify(f"{artist_name} {title}")
+                slug = _slugify(f"{artist_name} {title}")
                 discogs_url = f"https://www.discogs.com/release/{release_id}-{slug}" if release_id else None
 
                 # Format the line
@@ -275,13 +287,7 @@ Total: {total_items:,} items
                 format_display = format_emoji.get(format_name, '🎵')
 
                 # Create Discogs URL
-                def slugify(text):
-                    import re
-                    slug = re.sub(r'[^\w\-]+', '-', text)
-                    slug = re.sub(r'-+', '-', slug)
-                    return slug.strip('-')
-
-                slug = slugify(f"{artist_name} {title}")
+                slug = _slugify(f"{artist_name} {title}")
                 discogs_url = f"https://www.discogs.com/release/{release_id}-{slug}" if release_id else None
 
                 # Format the line
@@ -1,91 +1,183 @@
 from __future__ import annotations
 
+import asyncio
+import heapq
 import logging
 import re
 import time
 from io import BytesIO
+from operator import itemgetter
 from typing import Callable, Dict, Optional
+from urllib.parse import quote_plus
 
 import aiohttp
 from nio import AsyncClient, MatrixRoom
-from nio.responses import UploadError, UploadResponse
+from nio.responses import RoomCreateResponse, UploadError, UploadResponse
 from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# Largest image send_image_message will download and re-upload
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+
+MSGTYPE_TEXT = "m.text"
+FMT_HTML = "org.matrix.custom.html"
+
+
+def _text_content(body: str, html: str) -> dict:
+    """Build an m.text event content with an HTML formatted body."""
+    return {
+        "msgtype": MSGTYPE_TEXT,
+        "body": body,
+        "format": FMT_HTML,
+        "formatted_body": html,
+    }
+
+
+# Markdown handled by _markdown_to_html, as one alternation so each message
+# is scanned once: link, bold, italic, code, newline
+_RE_MARKDOWN = re.compile(
+    r"\[(.+?)\]\((.+?)\)|\*\*(.+?)\*\*|\*(.+?)\*|`(.+?)`|\n"
+)
+
+
+def _markdown_replace(m: re.Match) -> str:
+    link_text, href, bold, italic, code = m.groups()
+    if href is not None:
+        return f'<a href="{href}">{_RE_MARKDOWN.sub(_markdown_replace, link_text)}</a>'
+    if bold is not None:
+        return f"<strong>{_RE_MARKDOWN.sub(_markdown_replace, bold)}</strong>"
+    if italic is not None:
+        return f"<em>{_RE_MARKDOWN.sub(_markdown_replace, italic)}</em>"
+    if code is not None:
+        # Escape HTML entities inside code so <username> etc. render
+        code = code.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        return f"<code>{code}</code>"
+    return "<br/>"
+
+
+# Last.fm's placeholder images: known placeholder hashes and /noimage paths
+_PLACEHOLDER_IMAGE_RE = re.compile(
+    r"2a96cbd8b46e442fc41c2b86b821562f|/noimage", re.IGNORECASE
+)
+
+# generate_chart flags, matched case-insensitively
+_CHART_SKIP_EMPTY_FLAGS = frozenset({"--skipempty", "--skip-empty", "-s"})
+_CHART_NO_TITLES_FLAGS = frozenset({"--notitles", "--no-titles", "--notitle", "-n"})
+
 
 class LastfmCommandsMixin:
-    async def show_help(self, room: MatrixRoom, client: AsyncClient):
-        """Show help message."""
-        discogs_info = ""
-        if self.discogs:
-            discogs_info = f"\n\n**Discogs Integration:**\nUse `{self.config.command_prefix}discogs help` (dg help) for Discogs commands"
-
-        spotify_info = ""
-        if self.spotify:
-            spotify_info = (
-                f"\n\n**Spotify Commands:**\n"
-                f"`{self.config.command_prefix}spotify` (sp) - Get Spotify link for your now playing track\n"
-                f"`{self.config.command_prefix}spotify <artist> - <track>` (sp) - Search and get Spotify link for a specific track\n"
-                f"`{self.config.command_prefix}fm spotify` - Get Spotify link from within the fm command"
-            )
-
-        lyrics_info = (
-            f"\n\n**Lyrics Commands:**\n"
-            f"`{self.config.command_prefix}lyrics` (ly) - Show lyrics for your now playing track\n"
-            f"`{self.config.command_prefix}lyrics <artist> - <track>` (ly) - Show lyrics for a specific track\n"
-            f"`{self.config.command_prefix}fm lyrics` - Show lyrics from within the fm command"
-        )
 
-        help_text = f"""
+    # Rank labels for the whoknows top 5 and the room leaderboard top 10
+    _WHOKNOWS_LABELS = ("👑", "🥈", "🥉") + tuple(f"{i}." for i in range(4, 6))
+    _LEADERBOARD_LABELS = ("🥇", "🥈", "🥉") + tuple(f"{i}." for i in range(4, 11))
+
+    # Help text; {prefix} is the command prefix and the trailing fields hold
+    # the sections for optional integrations
+    _HELP_TEMPLATE = """
 FMatrix Bot - Last.fm Stats & Leaderboards
 
 **Main Commands:**
-`{self.config.command_prefix}fm` - Show now playing track (or `{self.config.command_prefix}fm <username>`)
-`{self.config.command_prefix}fm link <username>` (l) - Link Last.fm account & start authorization
-`{self.config.command_prefix}fm authcomplete` - Complete authorization after visiting auth link
-`{self.config.command_prefix}fm stats` (s) - Show listening stats
-`{self.config.command_prefix}fm topartists [period]` (tar) - Show top artists
-`{self.config.command_prefix}fm topalbums [period]` (ta/tb) - Show top albums
-`{self.config.command_prefix}fm toptracks [period]` (tt) - Show top tracks
-`{self.config.command_prefix}fm recent` (r) - Show recent tracks
+`{prefix}fm` - Show now playing track (or `{prefix}fm <username>`)
+`{prefix}fm link <username>` (l) - Link Last.fm account & start authorization
+`{prefix}fm authcomplete` - Complete authorization after visiting auth link
+`{prefix}fm stats` (s) - Show listening stats
+`{prefix}fm topartists [period]` (tar) - Show top artists
+`{prefix}fm topalbums [period]` (ta/tb) - Show top albums
+`{prefix}fm toptracks [period]` (tt) - Show top tracks
+`{prefix}fm recent` (r) - Show recent tracks
 
 **Track Commands:**
-`{self.config.command_prefix}fm track <artist> - <track>` - Show track info and playcount
-`{self.config.command_prefix}fm loved [username] [limit]` - Show user's loved tracks
-`{self.config.command_prefix}fm love <artist> - <track>` - Love a track (requires session key)
-`{self.config.command_prefix}fm unlove <artist> - <track>` - Unlove a track (requires session key)
+`{prefix}fm track <artist> - <track>` - Show track info and playcount
+`{prefix}fm loved [username] [limit]` - Show user's loved tracks
+`{prefix}fm love <artist> - <track>` - Love a track (requires session key)
+`{prefix}fm unlove <artist> - <track>` - Unlove a track (requires session key)
 
 **Room Commands:**
-`{self.config.command_prefix}fm whoknows [artist]` (wk) - Who in this room knows this artist (defaults to your current artist)
-`{self.config.command_prefix}fm whoknowstrack [track]` (wkt) - Who in this room knows this track (defaults to your current track)
-`{self.config.command_prefix}fm whoknowsalbum [album]` (wka) - Who in this room knows this album (defaults to your current album)
-`{self.config.command_prefix}fm chart [size] [period] [flags]` (c) - Generate album collage
-`{self.config.command_prefix}fm leaderboard [stat]` (lb) - Show room leaderboard
+`{prefix}fm whoknows [artist]` (wk) - Who in this room knows this artist (defaults to your current artist)
+`{prefix}fm whoknowstrack [track]` (wkt) - Who in this room knows this track (defaults to your current track)
+`{prefix}fm whoknowsalbum [album]` (wka) - Who in this room knows this album (defaults to your current album)
+`{prefix}fm chart [size] [period] [flags]` (c) - Generate album collage
+`{prefix}fm leaderboard [stat]` (lb) - Show room leaderboard
 
-`{self.config.command_prefix}fm help` (?) - Show this help
+`{prefix}fm help` (?) - Show this help
 
 **Period Abbreviations:**
 7days/7d, 1month/1m, 3month/3m, 6month/6m, 12month/12m, overall
 
 **Setup for Love/Unlove (One Command!):**
-1. Run: `{self.config.command_prefix}fm link <your_lastfm_username>`
+1. Run: `{prefix}fm link <your_lastfm_username>`
 2. Click the auth link
 3. Authorize on Last.fm
-4. Run: `{self.config.command_prefix}fm authcomplete`
+4. Run: `{prefix}fm authcomplete`
 Done! ✅
 
 **Examples:**
-`{self.config.command_prefix}fm` - Your now playing track
-`{self.config.command_prefix}fm link PlaylistNinja2000` - Link & start auth
-`{self.config.command_prefix}fm ta 7d` - Top albums last 7 days
-`{self.config.command_prefix}fm track The Beatles - Hey Jude` - Get Hey Jude info
-`{self.config.command_prefix}fm loved` - Show your loved tracks
-`{self.config.command_prefix}fm love Black Sabbath - Iron Man` - Love Iron Man
+`{prefix}fm` - Your now playing track
+`{prefix}fm link PlaylistNinja2000` - Link & start auth
+`{prefix}fm ta 7d` - Top albums last 7 days
+`{prefix}fm track The Beatles - Hey Jude` - Get Hey Jude info
+`{prefix}fm loved` - Show your loved tracks
+`{prefix}fm love Black Sabbath - Iron Man` - Love Iron Man
 
 **GitHub:** [Source Code](https://github.com/zerw0/fmatrix){discogs_info}{spotify_info}{lyrics_info}
         """
-        await self.send_message(room, help_text, client)
+    _DISCOGS_HELP_SECTION = (
+        "\n\n**Discogs Integration:**\n"
+        "Use `{prefix}discogs help` (dg help) for Discogs commands"
+    )
+    _SPOTIFY_HELP_SECTION = (
+        "\n\n**Spotify Commands:**\n"
+        "`{prefix}spotify` (sp) - Get Spotify link for your now playing track\n"
+        "`{prefix}spotify <artist> - <track>` (sp) - Search and get Spotify link for a specific track\n"
+        "`{prefix}fm spotify` - Get Spotify link from within the fm command"
+    )
+    _LYRICS_HELP_SECTION = (
+        "\n\n**Lyrics Commands:**\n"
+        "`{prefix}lyrics` (ly) - Show lyrics for your now playing track\n"
+        "`{prefix}lyrics <artist> - <track>` (ly) - Show lyrics for a specific track\n"
+        "`{prefix}fm lyrics` - Show lyrics from within the fm command"
+    )
+
+    # m.relates_to skeletons for the ⬅️ and ➡️ pagination reactions; the
+    # target event ID is filled in per message
+    _PAGINATION_RELATES_TO = (
+        {"rel_type": "m.annotation", "key": "⬅️"},
+        {"rel_type": "m.annotation", "key": "➡️"},
+    )
+
+    # Authorization instructions DM'd by link_user
+    _AUTH_DM_TEMPLATE = """🔐 **Last.fm Authorization Required**
+
+👉 **Click here to authorize:** {auth_url}
+
+**Steps:**
+1. Click the link above
+2. Click "Allow" on Last.fm to authorize this bot
+3. Come back to this room and run: `{prefix}fm authcomplete`
+4. Done! Your love/unlove commands will work
+
+*(Token expires in 10 minutes)*"""
+
+    async def show_help(self, room: MatrixRoom, client: AsyncClient):
+        """Show help message."""
+        if self._help_text is None:
+            self._help_text = self._build_help_text()
+        await self.send_message(room, self._help_text, client)
+
+    def _build_help_text(self) -> str:
+        """Render the help message for the configured prefix and integrations."""
+        prefix = self.config.command_prefix
+        return self._HELP_TEMPLATE.format(
+            prefix=prefix,
+            discogs_info=(
+                self._DISCOGS_HELP_SECTION.format(prefix=prefix) if self.discogs else ""
+            ),
+            spotify_info=(
+                self._SPOTIFY_HELP_SECTION.format(prefix=prefix) if self.spotify else ""
+            ),
+            lyrics_info=self._LYRICS_HELP_SECTION.format(prefix=prefix),
+        )
 
     async def link_user(
         self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
@@ -102,9 +194,13 @@ Done! ✅
 
         lastfm_username = args[0]
 
-        # Verify the username exists on Last.fm
+        # Verify the username exists on Last.fm; retried links reuse the lookup
         logger.info(f"Linking {sender} to Last.fm user {lastfm_username}")
-        user_info = await self.lastfm.get_user_info(lastfm_username)
+        user_info = await self._cached(
+            ("user_info", lastfm_username.lower()),
+            300,
+            lambda: self.lastfm.get_user_info(lastfm_username),
+        )
         if not user_info:
             await self.send_message(
                 room, f"❌ Last.fm user '{lastfm_username}' not found", client
@@ -117,6 +213,8 @@ Done! ✅
             await self.send_message(room, "❌ Failed to link account", client)
             return
         logger.info(f"Successfully linked {sender} to {lastfm_username}")
+        # Linking can add or displace users in any room's mapping
+        self._room_mapping_cache.clear()
 
         # Verify the link was saved
         saved_username = await self.db.get_lastfm_username(sender)
@@ -152,17 +250,9 @@ Done! ✅
             auth_url = self.lastfm.get_auth_url(auth_token)
             # Send authorization instructions via DM
             logger.info(f"Preparing DM message for {sender}")
-            message = f"""🔐 **Last.fm Authorization Required**
-
-👉 **Click here to authorize:** {auth_url}
-
-**Steps:**
-1. Click the link above
-2. Click "Allow" on Last.fm to authorize this bot
-3. Come back to this room and run: `{self.config.command_prefix}fm authcomplete`
-4. Done! Your love/unlove commands will work
-
-*(Token expires in 10 minutes)*"""
+            message = self._AUTH_DM_TEMPLATE.format(
+                auth_url=auth_url, prefix=self.config.command_prefix
+            )
 
             # Send via DM
             sent_dm = False
@@ -171,15 +261,13 @@ Done! ✅
                 user_id = (
                     sender
                     if sender.startswith("@")
-                    else f"@{sender}:{client.homeserver.split('https://')[-1]}"
+                    else f"@{sender}:{self._homeserver_domain(client)}"
                 )
                 logger.info(
                     f"Attempting to send DM to {sender} with full ID: {user_id}"
                 )
 
                 # Create DM room
-                from nio.responses import RoomCreateResponse
-
                 dm_response = await client.room_create(is_direct=True, invite=[user_id])
 
                 logger.info(
@@ -194,7 +282,7 @@ Done! ✅
                     send_response = await client.room_send(
                         dm_room_id,
                         "m.room.message",
-                        {"msgtype": "m.text", "body": message},
+                        {"msgtype": MSGTYPE_TEXT, "body": message},
                     )
                     logger.info(
                         f"DM message send response type: {type(send_response).__name__}"
@@ -360,7 +448,9 @@ The token expires in 10 minutes.
             return
 
         # Get stats
-        stats = await self.lastfm.get_user_stats(target_user)
+        stats = await self._cached(
+            ("stats", target_user), 60, lambda: self.lastfm.get_user_stats(target_user)
+        )
         if not stats:
             await self.send_message(
                 room, f"❌ Could not fetch stats for {target_user}", client
@@ -382,7 +472,7 @@ The token expires in 10 minutes.
         self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
     ):
         """Show user's top artists."""
-        period = self.normalize_period(args[0].lower()) if args else "overall"
+        period = self.normalize_period(args[0]) if args else "overall"
 
         if not await self._validate_period(room, period, client):
             return
@@ -391,7 +481,11 @@ The token expires in 10 minutes.
         if not target_user:
             return
 
-        artists = await self.lastfm.get_top_artists(target_user, period, limit=10)
+        artists = await self._cached(
+            ("topartists", target_user, period, 10),
+            300,
+            lambda: self.lastfm.get_top_artists(target_user, period, limit=10),
+        )
         if not artists:
             await self.send_message(
                 room, f"❌ Could not fetch top artists for {target_user}", client
@@ -399,12 +493,12 @@ The token expires in 10 minutes.
             return
 
         period_name = self._get_period_name(period)
-        message = f"**Top Artists ({period_name})**\n\n"
-
-        for i, artist in enumerate(artists, 1):
-            name = artist.get("name", "Unknown")
-            plays = artist.get("playcount", "0")
-            message += f"{i}. {name} - {plays} plays\n"
+        lines = [f"**Top Artists ({period_name})**\n"]
+        lines.extend(
+            f"{i}. {artist.get('name', 'Unknown')} - {artist.get('playcount', '0')} plays"
+            for i, artist in enumerate(artists, 1)
+        )
+        message = "\n".join(lines)
 
         await self.send_message(room, message, client)
 
@@ -412,7 +506,7 @@ The token expires in 10 minutes.
         self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
     ):
         """Show user's top albums."""
-        period = self.normalize_period(args[0].lower()) if args else "overall"
+        period = self.normalize_period(args[0]) if args else "overall"
 
         if not await self._validate_period(room, period, client):
             return
@@ -421,19 +515,19 @@ The token expires in 10 minutes.
         if not target_user:
             return
 
-        albums = await self.lastfm.get_top_albums(target_user, period, limit=10)
+        albums = await self._cached(
+            ("topalbums", target_user, period, 10),
+            300,
+            lambda: self.lastfm.get_top_albums(target_user, period, limit=10),
+        )
         if not albums:
             await self.send_message(room, f"❌ Could not fetch top albums", client)
             return
 
         period_name = self._get_period_name(period)
-        message = f"**Top Albums ({period_name})**\n\n"
-
-        for i, album in enumerate(albums, 1):
-            name = album.get("name", "Unknown")
-            artist_name = self._extract_artist_name(album.get("artist", {}))
-            plays = album.get("playcount", "0")
-            message += f"{i}. {name} by {artist_name} - {plays} plays\n"
+        lines = [f"**Top Albums ({period_name})**\n"]
+        lines.extend(self._numbered_rows(albums, with_plays=True))
+        message = "\n".join(lines)
 
         await self.send_message(room, message, client)
 
@@ -441,7 +535,7 @@ The token expires in 10 minutes.
         self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
     ):
         """Show user's top tracks."""
-        period = self.normalize_period(args[0].lower()) if args else "overall"
+        period = self.normalize_period(args[0]) if args else "overall"
 
         if not await self._validate_period(room, period, client):
             return
@@ -450,19 +544,19 @@ The token expires in 10 minutes.
         if not target_user:
             return
 
-        tracks = await self.lastfm.get_top_tracks(target_user, period, limit=10)
+        tracks = await self._cached(
+            ("toptracks", target_user, period, 10),
+            300,
+            lambda: self.lastfm.get_top_tracks(target_user, period, limit=10),
+        )
         if not tracks:
             await self.send_message(room, f"❌ Could not fetch top tracks", client)
             return
 
         period_name = self._get_period_name(period)
-        message = f"**Top Tracks ({period_name})**\n\n"
-
-        for i, track in enumerate(tracks, 1):
-            name = track.get("name", "Unknown")
-            artist_name = self._extract_artist_name(track.get("artist", {}))
-            plays = track.get("playcount", "0")
-            message += f"{i}. {name} by {artist_name} - {plays} plays\n"
+        lines = [f"**Top Tracks ({period_name})**\n"]
+        lines.extend(self._numbered_rows(tracks, with_plays=True))
+        message = "\n".join(lines)
 
         await self.send_message(room, message, client)
 
@@ -479,12 +573,9 @@ The token expires in 10 minutes.
             await self.send_message(room, f"❌ Could not fetch recent tracks", client)
             return
 
-        message = f"**Recent Tracks - {target_user}**\n\n"
-
-        for i, track in enumerate(tracks, 1):
-            name = track.get("name", "Unknown")
-            artist_name = self._extract_artist_name(track.get("artist", {}))
-            message += f"{i}. {name} by {artist_name}\n"
+        lines = [f"**Recent Tracks - {target_user}**\n"]
+        lines.extend(self._numbered_rows(tracks))
+        message = "\n".join(lines)
 
         await self.send_message(room, message, client)
 
@@ -550,11 +641,13 @@ The token expires in 10 minutes.
         if play_count is None:
             play_count = "N/A"
 
-        message = f"🎵 **Now Playing - {target_user}**\n\n"
-        message += f"**{name}**\n"
-        message += f"by *{artist_name}*\n"
-        message += f"on {album_name}\n"
-        message += f"Plays: {play_count}"
+        message = (
+            f"🎵 **Now Playing - {target_user}**\n\n"
+            f"**{name}**\n"
+            f"by *{artist_name}*\n"
+            f"on {album_name}\n"
+            f"Plays: {play_count}"
+        )
 
         self._now_playing_cache[target_user] = {
             "timestamp": time.monotonic(),
@@ -631,12 +724,15 @@ The token expires in 10 minutes.
         spotify_track = self._format_spotify_track(best_track)
 
         # Format message
-        message = f"🎵 **Spotify Link**\n\n"
-        message += f"**{spotify_track['name']}**\n"
-        message += f"by *{spotify_track['artist']}*\n"
+        parts = [
+            "🎵 **Spotify Link**\n\n",
+            f"**{spotify_track['name']}**\n",
+            f"by *{spotify_track['artist']}*\n",
+        ]
         if spotify_track.get("album"):
-            message += f"on {spotify_track['album']}\n"
-        message += f"\n🔗 [Open on Spotify]({spotify_track['url']})"
+            parts.append(f"on {spotify_track['album']}\n")
+        parts.append(f"\n🔗 [Open on Spotify]({spotify_track['url']})")
+        message = "".join(parts)
 
         await self.send_message(room, message, client)
 
@@ -722,14 +818,14 @@ The token expires in 10 minutes.
             plain_lyrics = plain_lyrics[:max_len].rsplit("\n", 1)[0]
             truncated = True
 
-        message = f"📝 **Lyrics: {lyrics_track}**\n"
-        message += f"by *{lyrics_artist}*\n"
+        parts = [f"📝 **Lyrics: {lyrics_track}**\n", f"by *{lyrics_artist}*\n"]
         if lyrics_album:
-            message += f"on {lyrics_album}\n"
-        message += f"\n{plain_lyrics}"
+            parts.append(f"on {lyrics_album}\n")
+        parts.append(f"\n{plain_lyrics}")
         if truncated:
-            message += "\n\n*(lyrics truncated — too long for a single message)*"
-        message += "\n\n*Powered by [lrclib.net](https://lrclib.net)*"
+            parts.append("\n\n*(lyrics truncated — too long for a single message)*")
+        parts.append("\n\n*Powered by [lrclib.net](https://lrclib.net)*")
+        message = "".join(parts)
 
         await self.send_message(room, message, client)
 
@@ -798,13 +894,16 @@ The token expires in 10 minutes.
             else "No tags"
         )
 
-        message = f"🎵 **Track Info: {name}**\n\n"
+        parts = [f"🎵 **Track Info: {name}**\n\n"]
         if resolved_artist != artist_name or resolved_track != track_name:
-            message += f"Closest match: {resolved_track} by {resolved_artist}\n"
-        message += f"**Artist:** {artist_name}\n"
-        message += f"**Listeners:** {listeners}\n"
-        message += f"**Total Plays:** {plays}\n"
-        message += f"**Tags:** {tag_str}"
+            parts.append(f"Closest match: {resolved_track} by {resolved_artist}\n")
+        parts.append(
+            f"**Artist:** {artist_name}\n"
+            f"**Listeners:** {listeners}\n"
+            f"**Total Plays:** {plays}\n"
+            f"**Tags:** {tag_str}"
+        )
+        message = "".join(parts)
 
         await self.send_message(room, message, client)
 
@@ -820,19 +919,20 @@ The token expires in 10 minutes.
         if args and args[0].isdigit():
             limit = min(int(args[0]), 50)
 
-        tracks = await self.lastfm.get_user_loved_tracks(target_user, limit=limit)
+        tracks = await self._cached(
+            ("loved", target_user, limit),
+            300,
+            lambda: self.lastfm.get_user_loved_tracks(target_user, limit=limit),
+        )
         if not tracks:
             await self.send_message(
                 room, f"❌ Could not fetch loved tracks for {target_user}", client
             )
             return
 
-        message = f"❤️ **Loved Tracks - {target_user}**\n\n"
-
-        for i, track in enumerate(tracks, 1):
-            name = track.get("name", "Unknown")
-            artist_name = self._extract_artist_name(track.get("artist", {}))
-            message += f"{i}. {name} by {artist_name}\n"
+        lines = [f"❤️ **Loved Tracks - {target_user}**\n"]
+        lines.extend(self._numbered_rows(tracks))
+        message = "\n".join(lines)
 
         await self.send_message(room, message, client)
 
@@ -925,6 +1025,7 @@ The token expires in 10 minutes.
                     )
 
         if success:
+            self._clear_cached("loved")
             if resolved_artist != artist_name or resolved_track != track_name:
                 await self.send_message(
                     room,
@@ -984,6 +1085,7 @@ The token expires in 10 minutes.
         )
         success = await self.lastfm.unlove_track(artist_name, track_name, session_key)
         if success:
+            self._clear_cached("loved")
             await self.send_message(
                 room, f"💔 Unloved: **{track_name}** by {artist_name}", client
             )
@@ -998,24 +1100,33 @@ The token expires in 10 minutes.
         """Show leaderboard of room members' Last.fm stats."""
         stat_type = args[0] if args else "playcounts"
 
-        # Get all room members
-        room_members = list(room.users.keys())
-        if not room_members:
+        if not room.users:
             await self.send_message(room, "❌ No members in room", client)
             return
 
         # Get Last.fm usernames for all members
-        user_mapping = await self.db.get_all_users_in_room(room.room_id, room_members)
+        user_mapping = await self._get_room_mapping(room)
         if not user_mapping:
             await self.send_message(
                 room, "❌ No one in this room has linked a Last.fm account", client
             )
             return
 
-        # Fetch stats
+        # Fetch stats for all users concurrently
+        lastfm_users = list(user_mapping.values())
+        results = await self._gather_lastfm(
+            self._cached(
+                ("stats", lastfm_user),
+                60,
+                lambda lastfm_user=lastfm_user: self.lastfm.get_user_stats(lastfm_user),
+            )
+            for lastfm_user in lastfm_users
+        )
         leaderboard_data = []
-        for matrix_user, lastfm_user in user_mapping.items():
-            stats = await self.lastfm.get_user_stats(lastfm_user)
+        for lastfm_user, stats in zip(lastfm_users, results):
+            if isinstance(stats, BaseException):
+                logger.error(f"Error fetching stats for {lastfm_user}: {stats}")
+                continue
             if stats:
                 leaderboard_data.append({"lastfm": lastfm_user, "stats": stats})
 
@@ -1047,14 +1158,12 @@ The token expires in 10 minutes.
             return
 
         # Build message
-        message = f"**🏆 Room Leaderboard - {stat_display}**\n\n"
-        medals = ["🥇", "🥈", "🥉"]
-
-        for i, entry in enumerate(leaderboard_data[:10], 1):
-            medal = medals[i - 1] if i <= 3 else f"{i}."
-            username = entry["lastfm"]
-            stat_value = entry["stats"][stat_key]
-            message += f"{medal} {username}: {stat_value:,}\n"
+        lines = [f"**🏆 Room Leaderboard - {stat_display}**\n"]
+        lines.extend(
+            f"{medal} {entry['lastfm']}: {entry['stats'][stat_key]:,}"
+            for medal, entry in zip(self._LEADERBOARD_LABELS, leaderboard_data)
+        )
+        message = "\n".join(lines)
 
         await self.send_message(room, message, client)
 
@@ -1086,6 +1195,121 @@ The token expires in 10 minutes.
             "album": album_name,
         }
 
+    @staticmethod
+    def _pick_large_image(image_list) -> Optional[str]:
+        """Return the first real 'large' (174px) image URL from a Last.fm image list."""
+        if not isinstance(image_list, list):
+            return None
+        for img in image_list:
+            if img.get("size") != "large":
+                continue
+            url = (img.get("#text") or "").strip()
+            if url and not _PLACEHOLDER_IMAGE_RE.search(url):
+                return url
+        return None
+
+    async def _get_room_playcounts(
+        self,
+        lastfm_users: list,
+        item_type: str,
+        item_key: str,
+        artist_key: Optional[str],
+        fetch: Callable,
+    ) -> Dict[str, int]:
+        """Resolve each user's playcount for one artist/track/album.
+
+        Fresh cached playcounts are read with a single query; only the
+        misses go to Last.fm via ``fetch``, concurrently.
+        """
+        playcounts = await self.db.get_cached_playcounts(
+            lastfm_users, item_type, item_key, artist_name=artist_key, max_age_hours=1
+        )
+        logger.debug(
+            f"Cached {item_type} playcounts for {item_key}: {len(playcounts)}/{len(lastfm_users)}"
+        )
+        missing = [user for user in lastfm_users if user not in playcounts]
+        results = await self._gather_lastfm(
+            self._single_flight(
+                ("playcount", item_type, item_key, artist_key, user),
+                lambda user=user: fetch(user),
+            )
+            for user in missing
+        )
+        for lastfm_user, playcount in zip(missing, results):
+            # gather hands back CancelledError too, which isn't an Exception
+            if isinstance(playcount, BaseException):
+                logger.error(
+                    f"Error fetching {item_type} playcount for {lastfm_user}: {playcount}"
+                )
+                continue
+            playcounts[lastfm_user] = playcount
+        return playcounts
+
+    @staticmethod
+    def _lastfm_url(*parts: str) -> str:
+        """Build a www.last.fm URL, escaping each path segment.
+
+        Uses quote_plus so spaces become '+', matching Last.fm's own links;
+        '/', '&', '#' and non-ASCII characters are percent-encoded.
+        """
+        return "https://www.last.fm/" + "/".join(quote_plus(part) for part in parts)
+
+    def _numbered_rows(self, items: list, with_plays: bool = False) -> list:
+        """Format "N. name by artist" rows, optionally with play counts.
+
+        Last.fm list rows nearly always carry every field, so they're read by
+        subscript; a list with a row missing one is formatted again with
+        defaults.
+        """
+        artist_name_of = self._artist_name_from_dict
+        try:
+            if with_plays:
+                return [
+                    f"{i}. {item['name']} by {artist_name_of(item['artist'])} - "
+                    f"{item['playcount']} plays"
+                    for i, item in enumerate(items, 1)
+                ]
+            return [
+                f"{i}. {item['name']} by {artist_name_of(item['artist'])}"
+                for i, item in enumerate(items, 1)
+            ]
+        except KeyError:
+            pass
+        if with_plays:
+            return [
+                f"{i}. {item.get('name', 'Unknown')} by "
+                f"{artist_name_of(item.get('artist', {}))} - "
+                f"{item.get('playcount', '0')} plays"
+                for i, item in enumerate(items, 1)
+            ]
+        return [
+            f"{i}. {item.get('name', 'Unknown')} by "
+            f"{artist_name_of(item.get('artist', {}))}"
+            for i, item in enumerate(items, 1)
+        ]
+
+    @classmethod
+    def _render_leaderboard(
+        cls, html_lines: list, body_lines: list, entries: list
+    ) -> tuple:
+        """Join the header lines with the top 5 whoknows rows; return (html, body)."""
+        rows = [
+            (label, user, cls._lastfm_url("user", user), f"{plays:,}")
+            for label, (user, plays) in zip(
+                cls._WHOKNOWS_LABELS, map(itemgetter("user", "plays"), entries)
+            )
+        ]
+        html = "\n".join(
+            [
+                *html_lines,
+                *[f"<br/>{m} <a href='{u}'>{n}</a> · {p}" for m, n, u, p in rows],
+            ]
+        )
+        body = "\n".join(
+            [*body_lines, *[f"{m} {n} ({u}) · {p}" for m, n, u, p in rows]]
+        )
+        return html, body
+
     async def who_knows(
         self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
     ):
@@ -1102,9 +1326,18 @@ The token expires in 10 minutes.
                 return
         else:
             artist_name = " ".join(args)
-        artists = await self.lastfm.search_artist(artist_name, limit=10)
+
+        # The room's linked accounts don't depend on the artist, so look them
+        # up while the artist is searched and its details fetched
+        mapping_task = asyncio.ensure_future(self._get_room_mapping(room))
+        try:
+            artists = await self.lastfm.search_artist(artist_name, limit=10)
+        except BaseException:
+            mapping_task.cancel()
+            raise
 
         if not artists:
+            mapping_task.cancel()
             await self.send_message(
                 room, f"❌ No artists found matching '{artist_name}'", client
             )
@@ -1117,29 +1350,31 @@ The token expires in 10 minutes.
         )
         artist_name_clean = top_artist.get("name", artist_name)
 
-        # Try to get image from search results first (as fallback)
-        search_image = None
-        search_image_list = top_artist.get("image", [])
-        placeholder_hashes = ["2a96cbd8b46e442fc41c2b86b821562f"]
-
-        if isinstance(search_image_list, list) and len(search_image_list) > 0:
-            # Get 'large' size (174s) instead of extralarge for more compact display
-            for img in search_image_list:
-                if img.get("size") == "large":
-                    img_url = img.get("#text", "").strip()
-                    if img_url and "/noimage" not in img_url.lower():
-                        is_placeholder = any(
-                            placeholder_hash in img_url
-                            for placeholder_hash in placeholder_hashes
-                        )
-                        if not is_placeholder:
-                            search_image = img_url
-                            break
+        # Image from search results, used as a fallback
+        search_image = self._pick_large_image(top_artist.get("image"))
+
+        # Without a search image the top album is the likely image source
+        # (Last.fm mostly serves placeholder artist images), so fetch it
+        # alongside the artist info rather than after it
+        albums_task = None
+        if not search_image:
+            albums_task = asyncio.ensure_future(
+                self.lastfm.get_artist_top_albums(artist_name_clean, limit=1)
+            )
 
         # Get detailed info
-        artist_info = await self.lastfm.get_artist_info(artist_name_clean)
+        try:
+            artist_info = await self.lastfm.get_artist_info(artist_name_clean)
+        except BaseException:
+            if albums_task:
+                albums_task.cancel()
+            mapping_task.cancel()
+            raise
 
         if not artist_info:
+            if albums_task:
+                albums_task.cancel()
+            mapping_task.cancel()
             await self.send_message(
                 room, f"❌ Could not fetch details for {artist_name_clean}", client
             )
@@ -1156,197 +1391,142 @@ The token expires in 10 minutes.
         else:
             genre = "Unknown"
 
-        # Get image - extract the extralarge/largest available
-        image = None
-        image_list = artist_info.get("image", [])
-
-        # Last.fm's known placeholder image hashes to filter out
-        placeholder_hashes = ["2a96cbd8b46e442fc41c2b86b821562f"]
+        # Get image - prefer artist info, then search results, then the
+        # artist's top album as a last resort
+        image = self._pick_large_image(artist_info.get("image")) or search_image
+        if image:
+            if albums_task:
+                albums_task.cancel()
+        elif albums_task:
+            logger.info(
+                f"Trying to fetch image from top album for {artist_name_clean}"
+            )
+            try:
+                top_albums = await albums_task
+            except BaseException:
+                mapping_task.cancel()
+                raise
+            if top_albums:
+                image = self._pick_large_image(top_albums[0].get("image"))
+        if image:
+            # Download and upload the image while the room's playcounts are
+            # fetched; it is posted before the leaderboard only if it's ready
+            logger.info(f"Downloading and uploading image: {image}")
+            image_upload = asyncio.ensure_future(
+                self._upload_image(image, artist_name_clean, client)
+            )
+        else:
+            image_upload = None
+            logger.info(f"No valid image available for {artist_name_clean} at all")
 
-        logger.info(f"Image list for {artist_name_clean}: {image_list}")
+        try:
+            # Build embed with artist leaderboard
+            user_mapping = await mapping_task
+            artist_cache_key = (
+                self._normalize_cache_text(artist_name_clean) or artist_name_clean
+            )
 
-        if isinstance(image_list, list) and len(image_list) > 0:
-            # Get 'large' size (174s) for more compact display
-            for img in image_list:
-                if img.get("size") == "large":
-                    img_url = img.get("#text", "").strip()
-                    if img_url and img_url != "" and "/noimage" not in img_url.lower():
-                        is_placeholder = any(
-                            placeholder_hash in img_url
-                            for placeholder_hash in placeholder_hashes
-                        )
-                        if not is_placeholder:
-                            image = img_url
-                            logger.info(f"Found valid image: {image}")
-                            break
-                        else:
-                            logger.info(f"Skipping placeholder image: {img_url}")
-
-        if not image:
-            logger.info(f"No valid image found for {artist_name_clean} in artist info")
-            # Fall back to search image
-            if search_image:
-                image = search_image
-                logger.info(f"Using image from search results: {image}")
-            else:
-                # Try to get image from artist's top album as last resort
-                logger.info(
-                    f"Trying to fetch image from top album for {artist_name_clean}"
+            async def fetch_playcount(lastfm_user: str) -> int:
+                # Get artist info with user's playcount from API
+                artist_data = await self.lastfm.get_artist_info(
+                    artist_name_clean, username=lastfm_user
                 )
-                top_albums = await self.lastfm.get_artist_top_albums(
-                    artist_name_clean, limit=1
+                if not artist_data or "stats" not in artist_data:
+                    return 0
+                user_playcount = artist_data["stats"].get("userplaycount", "0")
+                playcount = int(user_playcount) if user_playcount else 0
+                # Cache the result
+                await self.db.cache_playcount(
+                    lastfm_user, "artist", artist_cache_key, playcount
                 )
-                if top_albums and len(top_albums) > 0:
-                    album_image_list = top_albums[0].get("image", [])
-                    if isinstance(album_image_list, list):
-                        for img in album_image_list:
-                            if img.get("size") == "large":
-                                img_url = img.get("#text", "").strip()
-                                if img_url and "/noimage" not in img_url.lower():
-                                    is_placeholder = any(
-                                        h in img_url for h in placeholder_hashes
-                                    )
-                                    if not is_placeholder:
-                                        image = img_url
-                                        logger.info(
-                                            f"Using image from top album: {image}"
-                                        )
-                                        break
-
-                if not image:
-                    logger.info(
-                        f"No valid image available for {artist_name_clean} at all"
-                    )
-
-        # Get artist listeners and stats
-        listeners = artist_info.get("stats", {}).get("listeners", "N/A")
-        scrobbles = artist_info.get("stats", {}).get("playcount", "N/A")
-
-        # Format numbers safely
-        try:
-            listeners_formatted = f"{int(listeners):,}" if listeners != "N/A" else "N/A"
-        except (ValueError, TypeError):
-            listeners_formatted = "N/A"
-
-        try:
-            scrobbles_formatted = f"{int(scrobbles):,}" if scrobbles != "N/A" else "N/A"
-        except (ValueError, TypeError):
-            scrobbles_formatted = "N/A"
-
-        # Build embed with artist leaderboard
-        room_members = list(room.users.keys())
-        user_mapping = await self.db.get_all_users_in_room(room.room_id, room_members)
-        artist_cache_key = (
-            self._normalize_cache_text(artist_name_clean) or artist_name_clean
-        )
-
-        # Fetch each user's playcount for this specific artist (with caching)
-        room_listeners = []
-        for matrix_user, lastfm_user in user_mapping.items():
-            try:
-                # Check cache first
-                cached_playcount = await self.db.get_cached_playcount(
-                    lastfm_user, "artist", artist_cache_key, max_age_hours=1
+                logger.debug(
+                    "Cached playcount for %s/%s: %s",
+                    lastfm_user,
+                    artist_name_clean,
+                    playcount,
                 )
+                return playcount
+
+            # Fetch each user's playcount for this specific artist
+            playcounts = await self._get_room_playcounts(
+                list(user_mapping.values()),
+                "artist",
+                artist_cache_key,
+                None,
+                fetch_playcount,
+            )
+            room_listeners = [
+                {"user": lastfm_user, "plays": playcount}
+                for lastfm_user, playcount in playcounts.items()
+                if playcount > 0
+            ]
+
+            # Only the top 5 are shown
+            room_listeners = heapq.nlargest(
+                5, room_listeners, key=itemgetter("plays")
+            )
 
-                if cached_playcount is not None:
-                    playcount = cached_playcount
-                    logger.debug(
-                        f"Using cached playcount for {lastfm_user}/{artist_name_clean}: {playcount}"
+            # Send image as separate message (downloaded from Last.fm and
+            # uploaded to Matrix), only if we have a valid non-placeholder
+            # image. If the upload has already finished it goes above the
+            # leaderboard; otherwise the leaderboard doesn't wait for it and
+            # the image follows
+            if image_upload and image_upload.done():
+                uploaded = image_upload.result()
+                image_upload = None
+                if uploaded:
+                    await self._send_uploaded_image(
+                        room, uploaded, artist_name_clean, client
                     )
-                else:
-                    # Get artist info with user's playcount from API
-                    artist_data = await self.lastfm.get_artist_info(
-                        artist_name_clean, username=lastfm_user
-                    )
-                    if artist_data and "stats" in artist_data:
-                        user_playcount = artist_data["stats"].get("userplaycount", "0")
-                        playcount = int(user_playcount) if user_playcount else 0
-                        # Cache the result
-                        await self.db.cache_playcount(
-                            lastfm_user, "artist", artist_cache_key, playcount
-                        )
-                        logger.debug(
-                            f"Cached playcount for {lastfm_user}/{artist_name_clean}: {playcount}"
-                        )
-                    else:
-                        playcount = 0
 
-                if playcount > 0:
-                    room_listeners.append({"user": lastfm_user, "plays": playcount})
-            except Exception as e:
-                logger.error(f"Error fetching artist playcount for {lastfm_user}: {e}")
-                pass
-
-        room_listeners.sort(key=lambda x: x["plays"], reverse=True)
-
-        # Send image as separate message (downloaded from Last.fm and uploaded to Matrix)
-        # Only if we have a valid non-placeholder image
-        if (
-            image
-            and "/noimage" not in image.lower()
-            and "2a96cbd8b46e442fc41c2b86b821562f" not in image
-        ):
-            logger.info(f"Downloading and uploading image: {image}")
-            await self.send_image_message(room, image, artist_name_clean, client)
-        else:
-            logger.info(f"No valid image to display for {artist_name_clean}")
-
-        # Build minimal HTML embed
-        html_parts = []
-        artist_url = f"https://www.last.fm/music/{artist_name_clean.replace(' ', '+')}"
-        html_parts.append(f"<b><a href='{artist_url}'>{artist_name_clean}</a></b>")
-        html_parts.append(f"<br/>{genre}")
-
-        # Add leaderboard
-        if room_listeners:
-            html_parts.append("<br/>")
-            medals = ["👑", "🥈", "🥉"]
-            for i, listener in enumerate(room_listeners[:5], 1):  # Show top 5 only
-                medal = medals[i - 1] if i <= 3 else f"{i}."
-                user_url = f"https://www.last.fm/user/{listener['user']}"
-                html_parts.append(
-                    f"<br/>{medal} <a href='{user_url}'>{listener['user']}</a> · {listener['plays']:,}"
-                )
-
-        html = "\n".join(html_parts)
-
-        # Build plain text version
-        artist_url = f"https://www.last.fm/music/{artist_name_clean.replace(' ', '+')}"
-        body_lines = [f"{artist_name_clean} - {artist_url}", genre, ""]
+            # Build minimal HTML embed and plain text version together
+            artist_url = self._lastfm_url("music", artist_name_clean)
+            html_parts = [
+                f"<b><a href='{artist_url}'>{artist_name_clean}</a></b>",
+                f"<br/>{genre}",
+            ]
+            if room_listeners:
+                html_parts.append("<br/>")
+
+            # Add leaderboard (top 5 only)
+            html, body = self._render_leaderboard(
+                html_parts,
+                [f"{artist_name_clean} - {artist_url}", genre, ""],
+                room_listeners,
+            )
 
-        if room_listeners:
-            medals_text = ["👑", "🥈", "🥉"]
-            for i, listener in enumerate(room_listeners[:5], 1):  # Show top 5 only
-                medal = medals_text[i - 1] if i <= 3 else f"{i}."
-                user_url = f"https://www.last.fm/user/{listener['user']}"
-                body_lines.append(
-                    f"{medal} {listener['user']} ({user_url}) · {listener['plays']:,}"
-                )
-        body = "\n".join(body_lines)
+            # Send embed
+            await client.room_send(
+                room_id=room.room_id,
+                message_type="m.room.message",
+                content=_text_content(body, html),
+            )
 
-        # Send embed
-        await client.room_send(
-            room_id=room.room_id,
-            message_type="m.room.message",
-            content={
-                "msgtype": "m.text",
-                "body": body,
-                "format": "org.matrix.custom.html",
-                "formatted_body": html,
-            },
-        )
+            if image_upload:
+                uploaded = await image_upload
+                if uploaded:
+                    await self._send_uploaded_image(
+                        room, uploaded, artist_name_clean, client
+                    )
+        finally:
+            # Don't leave the upload running if the leaderboard failed; a
+            # no-op once the image has been consumed
+            if image_upload:
+                image_upload.cancel()
 
     async def who_knows_track(
         self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
     ):
         """Show who in the room listens to this track."""
         if not args:
+            # Now playing already gives the exact artist and track, so the
+            # per-user track.getInfo lookups can skip the fuzzy search
             now_playing = await self._get_now_playing_context(room, sender, client)
             if not now_playing:
                 return
-            track_query = f"{now_playing['artist']} {now_playing['track']}".strip()
-            if not track_query:
+            track_name = now_playing["track"]
+            artist_name = now_playing["artist"]
+            if not track_name or not artist_name:
                 await self.send_message(
                     room, "❌ No track found for your current listen", client
                 )
@@ -1354,26 +1534,26 @@ The token expires in 10 minutes.
         else:
             track_query = " ".join(args)
 
-        # Search for the track to get the canonical name
-        tracks = await self.lastfm.search_track(track_query, limit=10)
-        if not tracks:
-            await self.send_message(
-                room, f"❌ No tracks found matching '{track_query}'", client
-            )
-            return
+            # Search for the track to get the canonical name
+            tracks = await self.lastfm.search_track(track_query, limit=10)
+            if not tracks:
+                await self.send_message(
+                    room, f"❌ No tracks found matching '{track_query}'", client
+                )
+                return
 
-        # Pick closest + most popular result
-        top_track = (
-            self._select_best_lastfm_result(tracks, track_query, "track") or tracks[0]
-        )
-        track_name = top_track.get("name", track_query)
-        artist_name = self._extract_artist_name(top_track.get("artist", {}))
+            # Pick closest + most popular result
+            top_track = (
+                self._select_best_lastfm_result(tracks, track_query, "track")
+                or tracks[0]
+            )
+            track_name = top_track.get("name", track_query)
+            artist_name = self._extract_artist_name(top_track.get("artist", {}))
         track_cache_key = self._normalize_cache_text(track_name) or track_name
         artist_cache_key = self._normalize_cache_text(artist_name) or artist_name
 
         # Get room members and their Last.fm accounts
-        room_members = list(room.users.keys())
-        user_mapping = await self.db.get_all_users_in_room(room.room_id, room_members)
+        user_mapping = await self._get_room_mapping(room)
 
         if not user_mapping:
             await self.send_message(
@@ -1383,61 +1563,42 @@ The token expires in 10 minutes.
             )
             return
 
-        # Fetch each user's playcount for this specific track (with caching)
-        room_listeners = []
-        for matrix_user, lastfm_user in user_mapping.items():
-            try:
-                # Check cache first
-                cached_playcount = await self.db.get_cached_playcount(
-                    lastfm_user,
-                    "track",
-                    track_cache_key,
-                    artist_name=artist_cache_key,
-                    max_age_hours=1,
-                )
-
-                if cached_playcount is not None:
-                    playcount = cached_playcount
-                    logger.debug(
-                        f"Using cached playcount for {lastfm_user}/{artist_name}/{track_name}: {playcount}"
-                    )
-                else:
-                    # Get track info with user's playcount from API
-                    track_data = await self.lastfm.get_track_info(
-                        artist_name, track_name, username=lastfm_user
-                    )
-                    if track_data and "userplaycount" in track_data:
-                        playcount = (
-                            int(track_data["userplaycount"])
-                            if track_data["userplaycount"]
-                            else 0
-                        )
-                        # Cache the result
-                        await self.db.cache_playcount(
-                            lastfm_user,
-                            "track",
-                            track_cache_key,
-                            playcount,
-                            artist_name=artist_cache_key,
-                        )
-                        logger.debug(
-                            f"Cached playcount for {lastfm_user}/{artist_name}/{track_name}: {playcount}"
-                        )
-                    else:
-                        playcount = 0
-
-                if playcount > 0:
-                    room_listeners.append(
-                        {
-                            "user": lastfm_user,
-                            "track": track_name,
-                            "artist": artist_name,
-                            "plays": playcount,
-                        }
-                    )
-            except Exception as e:
-                logger.error(f"Error fetching track playcount for {lastfm_user}: {e}")
-                pass
+        async def fetch_playcount(lastfm_user: str) -> int:
+            # Get track info with user's playcount from API
+            track_data = await self.lastfm.get_track_info(
+                artist_name, track_name, username=lastfm_user
+            )
+            if not track_data or "userplaycount" not in track_data:
+                return 0
+            playcount = (
+                int(track_data["userplaycount"]) if track_data["userplaycount"] else 0
+            )
+            # Cache the result
+            await self.db.cache_playcount(
+                lastfm_user,
+                "track",
+                track_cache_key,
+                playcount,
+                artist_name=artist_cache_key,
+            )
+            logger.debug(
+                f"Cached playcount for {lastfm_user}/{artist_name}/{track_name}: {playcount}"
+            )
+            return playcount
+
+        # Fetch each user's playcount for this specific track
+        playcounts = await self._get_room_playcounts(
+            list(user_mapping.values()),
+            "track",
+            track_cache_key,
+            artist_cache_key,
+            fetch_playcount,
+        )
+        room_listeners = [
+            {"user": lastfm_user, "plays": playcount}
+            for lastfm_user, playcount in playcounts.items()
+            if playcount > 0
+        ]
 
         if not room_listeners:
             await self.send_message(
@@ -1447,50 +1608,27 @@ The token expires in 10 minutes.
             )
             return
 
-        # Sort by plays
-        room_listeners.sort(key=lambda x: x["plays"], reverse=True)
-
-        # Build HTML message
-        html_parts = []
-        first_listener = room_listeners[0]
-        track_url = f"https://www.last.fm/music/{first_listener['artist'].replace(' ', '+')}/_/{first_listener['track'].replace(' ', '+')}"
-        html_parts.append(
-            f"<b><a href='{track_url}'>{first_listener['track']}</a></b> by {first_listener['artist']}"
+        # Only the top 5 are shown
+        room_listeners = heapq.nlargest(5, room_listeners, key=itemgetter("plays"))
+
+        # Build HTML message and plain text version together
+        track_url = self._lastfm_url("music", artist_name, "_", track_name)
+        html, body = self._render_leaderboard(
+            [
+                f"<b><a href='{track_url}'>{track_name}</a></b> by {artist_name}",
+                "<br/>",
+            ],
+            [
+                f"{track_name} by {artist_name} - {track_url}",
+                "",
+            ],
+            room_listeners,
         )
-        html_parts.append("<br/>")
-
-        medals = ["👑", "🥈", "🥉"]
-        for i, listener in enumerate(room_listeners[:5], 1):
-            medal = medals[i - 1] if i <= 3 else f"{i}."
-            user_url = f"https://www.last.fm/user/{listener['user']}"
-            html_parts.append(
-                f"<br/>{medal} <a href='{user_url}'>{listener['user']}</a> · {listener['plays']:,}"
-            )
-
-        html = "\n".join(html_parts)
-
-        # Build plain text version
-        body_lines = [
-            f"{first_listener['track']} by {first_listener['artist']} - {track_url}",
-            "",
-        ]
-        for i, listener in enumerate(room_listeners[:5], 1):
-            medal = medals[i - 1] if i <= 3 else f"{i}."
-            user_url = f"https://www.last.fm/user/{listener['user']}"
-            body_lines.append(
-                f"{medal} {listener['user']} ({user_url}) · {listener['plays']:,}"
-            )
-        body = "\n".join(body_lines)
 
         await client.room_send(
             room_id=room.room_id,
             message_type="m.room.message",
-            content={
-                "msgtype": "m.text",
-                "body": body,
-                "format": "org.matrix.custom.html",
-                "formatted_body": html,
-            },
+            content=_text_content(body, html),
         )
 
     async def who_knows_album(
@@ -1539,8 +1677,7 @@ The token expires in 10 minutes.
         artist_cache_key = self._normalize_cache_text(artist_name) or artist_name
 
         # Get room members and their Last.fm accounts
-        room_members = list(room.users.keys())
-        user_mapping = await self.db.get_all_users_in_room(room.room_id, room_members)
+        user_mapping = await self._get_room_mapping(room)
 
         if not user_mapping:
             await self.send_message(
@@ -1550,61 +1687,42 @@ The token expires in 10 minutes.
             )
             return
 
-        # Fetch each user's playcount for this specific album (with caching)
-        room_listeners = []
-        for matrix_user, lastfm_user in user_mapping.items():
-            try:
-                # Check cache first
-                cached_playcount = await self.db.get_cached_playcount(
-                    lastfm_user,
-                    "album",
-                    album_cache_key,
-                    artist_name=artist_cache_key,
-                    max_age_hours=1,
-                )
-
-                if cached_playcount is not None:
-                    playcount = cached_playcount
-                    logger.debug(
-                        f"Using cached playcount for {lastfm_user}/{artist_name}/{album_name}: {playcount}"
-                    )
-                else:
-                    # Get album info with user's playcount from API
-                    album_data = await self.lastfm.get_album_info(
-                        artist_name, album_name, username=lastfm_user
-                    )
-                    if album_data and "userplaycount" in album_data:
-                        playcount = (
-                            int(album_data["userplaycount"])
-                            if album_data["userplaycount"]
-                            else 0
-                        )
-                        # Cache the result
-                        await self.db.cache_playcount(
-                            lastfm_user,
-                            "album",
-                            album_cache_key,
-                            playcount,
-                            artist_name=artist_cache_key,
-                        )
-                        logger.debug(
-                            f"Cached playcount for {lastfm_user}/{artist_name}/{album_name}: {playcount}"
-                        )
-                    else:
-                        playcount = 0
-
-                if playcount > 0:
-                    room_listeners.append(
-                        {
-                            "user": lastfm_user,
-                            "album": album_name,
-                            "artist": artist_name,
-                            "plays": playcount,
-                        }
-                    )
-            except Exception as e:
-                logger.error(f"Error fetching album playcount for {lastfm_user}: {e}")
-                pass
+        async def fetch_playcount(lastfm_user: str) -> int:
+            # Get album info with user's playcount from API
+            album_data = await self.lastfm.get_album_info(
+                artist_name, album_name, username=lastfm_user
+            )
+            if not album_data or "userplaycount" not in album_data:
+                return 0
+            playcount = (
+                int(album_data["userplaycount"]) if album_data["userplaycount"] else 0
+            )
+            # Cache the result
+            await self.db.cache_playcount(
+                lastfm_user,
+                "album",
+                album_cache_key,
+                playcount,
+                artist_name=artist_cache_key,
+            )
+            logger.debug(
+                f"Cached playcount for {lastfm_user}/{artist_name}/{album_name}: {playcount}"
+            )
+            return playcount
+
+        # Fetch each user's playcount for this specific album
+        playcounts = await self._get_room_playcounts(
+            list(user_mapping.values()),
+            "album",
+            album_cache_key,
+            artist_cache_key,
+            fetch_playcount,
+        )
+        room_listeners = [
+            {"user": lastfm_user, "plays": playcount}
+            for lastfm_user, playcount in playcounts.items()
+            if playcount > 0
+        ]
 
         if not room_listeners:
             await self.send_message(
@@ -1614,50 +1732,27 @@ The token expires in 10 minutes.
             )
             return
 
-        # Sort by plays
-        room_listeners.sort(key=lambda x: x["plays"], reverse=True)
-
-        # Build HTML message
-        html_parts = []
-        first_listener = room_listeners[0]
-        album_url = f"https://www.last.fm/music/{first_listener['artist'].replace(' ', '+')}/_/{first_listener['album'].replace(' ', '+')}"
-        html_parts.append(
-            f"<b><a href='{album_url}'>{first_listener['album']}</a></b> by {first_listener['artist']}"
+        # Only the top 5 are shown
+        room_listeners = heapq.nlargest(5, room_listeners, key=itemgetter("plays"))
+
+        # Build HTML message and plain text version together
+        album_url = self._lastfm_url("music", artist_name, album_name)
+        html, body = self._render_leaderboard(
+            [
+                f"<b><a href='{album_url}'>{album_name}</a></b> by {artist_name}",
+                "<br/>",
+            ],
+            [
+                f"{album_name} by {artist_name} - {album_url}",
+                "",
+            ],
+            room_listeners,
         )
-        html_parts.append("<br/>")
-
-        medals = ["👑", "🥈", "🥉"]
-        for i, listener in enumerate(room_listeners[:5], 1):
-            medal = medals[i - 1] if i <= 3 else f"{i}."
-            user_url = f"https://www.last.fm/user/{listener['user']}"
-            html_parts.append(
-                f"<br/>{medal} <a href='{user_url}'>{listener['user']}</a> · {listener['plays']:,}"
-            )
-
-        html = "\n".join(html_parts)
-
-        # Build plain text version
-        body_lines = [
-            f"{first_listener['album']} by {first_listener['artist']} - {album_url}",
-            "",
-        ]
-        for i, listener in enumerate(room_listeners[:5], 1):
-            medal = medals[i - 1] if i <= 3 else f"{i}."
-            user_url = f"https://www.last.fm/user/{listener['user']}"
-            body_lines.append(
-                f"{medal} {listener['user']} ({user_url}) · {listener['plays']:,}"
-            )
-        body = "\n".join(body_lines)
 
         await client.room_send(
             room_id=room.room_id,
             message_type="m.room.message",
-            content={
-                "msgtype": "m.text",
-                "body": body,
-                "format": "org.matrix.custom.html",
-                "formatted_body": html,
-            },
+            content=_text_content(body, html),
         )
 
     async def generate_chart(
@@ -1673,24 +1768,26 @@ The token expires in 10 minutes.
         # Filter out flags
         filtered_args = []
         for arg in args:
-            if arg.lower() in ["--skipempty", "--skip-empty", "-s"]:
+            arg_lower = arg.lower()
+            if arg_lower in _CHART_SKIP_EMPTY_FLAGS:
                 skip_empty = True
-            elif arg.lower() in ["--notitles", "--no-titles", "--notitle", "-n"]:
+            elif arg_lower in _CHART_NO_TITLES_FLAGS:
                 show_titles = False
             else:
-                filtered_args.append(arg)
+                filtered_args.append(arg_lower)
 
+        # Sizes and periods are case-insensitive, so the args are kept lowered
         if filtered_args:
             # Check if first arg is a size (NxN format)
-            if "x" in filtered_args[0].lower():
-                size = filtered_args[0].lower()
+            if "x" in filtered_args[0]:
+                size = filtered_args[0]
                 if len(filtered_args) > 1:
                     period = self.normalize_period(filtered_args[1])
             else:
                 # First arg is period
                 period = self.normalize_period(filtered_args[0])
-                if len(filtered_args) > 1 and "x" in filtered_args[1].lower():
-                    size = filtered_args[1].lower()
+                if len(filtered_args) > 1 and "x" in filtered_args[1]:
+                    size = filtered_args[1]
 
         # Validate size
         try:
@@ -1733,10 +1830,14 @@ The token expires in 10 minutes.
             )
             return
 
+        # Resolve each artist name once for both the font check and the tiles
+        artist_names = [
+            self._extract_artist_name(album.get("artist", {})) for album in albums
+        ]
+
         cyrillic_needed = False
-        for album in albums:
+        for album, artist_name in zip(albums, artist_names):
             album_name = album.get("name", "") or ""
-            artist_name = self._extract_artist_name(album.get("artist", {}))
             if self._contains_cyrillic(album_name) or self._contains_cyrillic(
                 artist_name
             ):
@@ -1747,14 +1848,13 @@ The token expires in 10 minutes.
         tile_size = 300
         album_tiles = []  # List of (image, album_name, artist_name, has_cover)
 
-        session = await self.lastfm.get_session()
-        for album in albums:
+        session = await self._get_http_session()
+        for album, artist_name in zip(albums, artist_names):
             if len(album_tiles) >= total_albums:
                 break
 
             image_url = None
             album_name = album.get("name", "Unknown")
-            artist_name = self._extract_artist_name(album.get("artist", {}))
 
             # Get extralarge image (300x300)
             album_images = album.get("image", [])
@@ -1848,6 +1948,7 @@ The token expires in 10 minutes.
         # Save to BytesIO
         image_buffer = BytesIO()
         collage.save(image_buffer, format="PNG")
+        image_size = image_buffer.tell()
         image_buffer.seek(0)
 
         # Upload to Matrix
@@ -1856,7 +1957,7 @@ The token expires in 10 minutes.
                 image_buffer,
                 content_type="image/png",
                 filename=f"{lastfm_user}_{size}_{period}_chart.png",
-                filesize=len(image_buffer.getvalue()),
+                filesize=image_size,
             )
 
             if isinstance(upload_response, UploadResponse):
@@ -1869,7 +1970,7 @@ The token expires in 10 minutes.
                         "url": upload_response.content_uri,
                         "info": {
                             "mimetype": "image/png",
-                            "size": len(image_buffer.getvalue()),
+                            "size": image_size,
                             "w": collage_width,
                             "h": collage_height,
                         },
@@ -1892,12 +1993,7 @@ The token expires in 10 minutes.
         response = await client.room_send(
             room_id=room.room_id,
             message_type="m.room.message",
-            content={
-                "msgtype": "m.text",
-                "body": message,
-                "format": "org.matrix.custom.html",
-                "formatted_body": self._markdown_to_html(message),
-            },
+            content=_text_content(message, self._markdown_to_html(message)),
         )
         return response.event_id if hasattr(response, "event_id") else None
 
@@ -1921,43 +2017,23 @@ The token expires in 10 minutes.
             )
             # Register pagination
             self.pagination.register(
-                event_id, room.room_id, user_id, current_page, total_pages, callback
+                event_id,
+                room.room_id,
+                user_id,
+                current_page,
+                total_pages,
+                callback,
+                {current_page: (time.monotonic(), message)},
             )
             logger.debug(
                 f"Pagination registered. Active paginations: {list(self.pagination.paginations.keys())}"
             )
 
             # Add initial reaction arrows so users know they can click
-            import asyncio
-
             await asyncio.sleep(0.1)  # Small delay to ensure message is processed
 
-            logger.debug(f"Adding ⬅️ reaction to {event_id}")
-            await client.room_send(
-                room_id=room.room_id,
-                message_type="m.reaction",
-                content={
-                    "m.relates_to": {
-                        "rel_type": "m.annotation",
-                        "event_id": event_id,
-                        "key": "⬅️",
-                    }
-                },
-            )
-
-            logger.debug(f"Adding ➡️ reaction to {event_id}")
-            await client.room_send(
-                room_id=room.room_id,
-                message_type="m.reaction",
-                content={
-                    "m.relates_to": {
-                        "rel_type": "m.annotation",
-                        "event_id": event_id,
-                        "key": "➡️",
-                    }
-                },
-            )
-            logger.debug(f"Initial reactions added to {event_id}")
+            self._queue_pagination_reactions(room, event_id, client)
+            logger.debug(f"Initial reactions queued for {event_id}")
         else:
             logger.debug(
                 f"Not adding pagination - event_id: {event_id}, total_pages: {total_pages}"
@@ -1965,6 +2041,53 @@ The token expires in 10 minutes.
 
         return event_id
 
+    def _queue_pagination_reactions(
+        self, room: MatrixRoom, event_id: str, client: AsyncClient
+    ):
+        """Queue the ⬅️ and ➡️ navigation reactions for a message.
+
+        The reactions are sent by _reaction_worker, which is started on
+        first use.
+        """
+        if self._reaction_queue is None:
+            self._reaction_queue = asyncio.Queue()
+            self._reaction_worker_task = asyncio.create_task(self._reaction_worker())
+        self._reaction_queue.put_nowait((client, room.room_id, event_id))
+
+    async def _reaction_worker(self):
+        """Send queued reactions, batching whatever has piled up meanwhile.
+
+        Messages in a batch are handled concurrently, but each message's
+        reactions go out in order so clients show ⬅️ before ➡️.
+        """
+        queue = self._reaction_queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.REACTION_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            results = await asyncio.gather(
+                *(
+                    self._send_pagination_reactions(client, room_id, event_id)
+                    for client, room_id, event_id in batch
+                ),
+                return_exceptions=True,
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.warning("Could not add pagination reaction: %s", result)
+
+    async def _send_pagination_reactions(
+        self, client: AsyncClient, room_id: str, event_id: str
+    ):
+        """Send the ⬅️ and ➡️ reactions for one message, one after the other."""
+        for relates_to in self._PAGINATION_RELATES_TO:
+            await client.room_send(
+                room_id=room_id,
+                message_type="m.reaction",
+                content={"m.relates_to": {**relates_to, "event_id": event_id}},
+            )
+
     async def edit_message(
         self, room: MatrixRoom, event_id: str, new_message: str, client: AsyncClient
     ):
@@ -1972,22 +2095,14 @@ The token expires in 10 minutes.
         logger.info(f"Editing message {event_id}")
 
         # Simply edit the message - Matrix will preserve user reactions
+        html = self._markdown_to_html(new_message)
+        content = _text_content(f"* {new_message}", f"* {html}")
+        content["m.new_content"] = _text_content(new_message, html)
+        content["m.relates_to"] = {"rel_type": "m.replace", "event_id": event_id}
         await client.room_send(
             room_id=room.room_id,
             message_type="m.room.message",
-            content={
-                "msgtype": "m.text",
-                "body": f"* {new_message}",
-                "format": "org.matrix.custom.html",
-                "formatted_body": f"* {self._markdown_to_html(new_message)}",
-                "m.new_content": {
-                    "msgtype": "m.text",
-                    "body": new_message,
-                    "format": "org.matrix.custom.html",
-                    "formatted_body": self._markdown_to_html(new_message),
-                },
-                "m.relates_to": {"rel_type": "m.replace", "event_id": event_id},
-            },
+            content=content,
         )
         logger.info(f"Message edited successfully")
 
@@ -1995,62 +2110,125 @@ The token expires in 10 minutes.
         self, room: MatrixRoom, image_url: str, artist_name: str, client: AsyncClient
     ):
         """Download image from Last.fm and upload to Matrix, then send."""
+        uploaded = await self._upload_image(image_url, artist_name, client)
+        if uploaded:
+            await self._send_uploaded_image(room, uploaded, artist_name, client)
+
+    async def _upload_image(
+        self, image_url: str, artist_name: str, client: AsyncClient
+    ) -> Optional[tuple]:
+        """Download image from Last.fm and upload it to Matrix.
+
+        Returns (content_uri, content_type), or None if the image could not
+        be fetched or uploaded. Split from the send so callers can start the
+        upload early and post the image once their text is ready.
+
+        A Content-Length over the cap, or a body that doesn't start like a
+        PNG or JPEG, is rejected before the rest of the body is read.
+        """
         try:
             # Download the image
-            session = await self.lastfm.get_session()
+            session = await self._get_http_session()
             async with session.get(
                 image_url, timeout=aiohttp.ClientTimeout(total=10)
             ) as resp:
                 if resp.status != 200:
-                    logger.error(f"Failed to download image: HTTP {resp.status}")
+                    logger.error("Failed to download image: HTTP %s", resp.status)
                     return
 
-                image_data = await resp.read()
                 content_type = resp.headers.get("Content-Type", "image/png")
+                file_size = resp.content_length
 
                 logger.info(
-                    f"Downloaded image: {len(image_data)} bytes, Content-Type: {content_type}"
+                    "Downloading image: %s bytes, Content-Type: %s", file_size, content_type
                 )
-                logger.info(f"First 50 bytes: {image_data[:50]}")
 
                 # Verify we got actual image data
-                if len(image_data) < 100:
+                if file_size is not None and file_size < 100:
                     logger.error(
-                        f"Image data too small ({len(image_data)} bytes), likely not a valid image"
+                        "Image data too small (%s bytes), likely not a valid image",
+                        file_size,
                     )
                     return
+                if file_size is not None and file_size > MAX_IMAGE_BYTES:
+                    logger.error("Image too large (%s bytes), skipping", file_size)
+                    resp.close()
+                    return
 
-                # Check for PNG or JPEG magic bytes
-                if not (
-                    image_data[:8] == b"\x89PNG\r\n\x1a\n"
-                    or image_data[:2] == b"\xff\xd8"
-                ):
+                # Check for PNG or JPEG magic bytes before committing to the upload
+                try:
+                    head = await resp.content.readexactly(8)
+                except asyncio.IncompleteReadError as e:
                     logger.error(
-                        f"Invalid image format. Magic bytes: {image_data[:10]}"
+                        "Image data too small (%d bytes), likely not a valid image",
+                        len(e.partial),
                     )
                     return
+                if not (head == b"\x89PNG\r\n\x1a\n" or head[:2] == b"\xff\xd8"):
+                    logger.error("Invalid image format. Magic bytes: %r", head)
+                    # Drop the connection rather than leave the body unread
+                    resp.close()
+                    return
+
+                # Buffer the body (bounded) in a single BytesIO. Content-Length
+                # is only a hint: the cap applies to the bytes actually read
+                expected_size = file_size
+                buffer = BytesIO()
+                buffer.write(head)
+                file_size = len(head)
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    file_size += len(chunk)
+                    if file_size > MAX_IMAGE_BYTES:
+                        logger.error(
+                            "Image too large (over %d bytes), skipping",
+                            MAX_IMAGE_BYTES,
+                        )
+                        resp.close()
+                        return
+                    buffer.write(chunk)
+
+            # More bytes than declared is fine (e.g. a decoded compressed
+            # body); the upload sends the size actually read. Fewer means
+            # the download was cut short
+            if expected_size is not None and file_size < expected_size:
+                logger.error(
+                    "Image download incomplete (%d of %d bytes)",
+                    file_size,
+                    expected_size,
+                )
+                return
+            if file_size < 100:
+                logger.error(
+                    "Image data too small (%d bytes), likely not a valid image",
+                    file_size,
+                )
+                return
 
-            # Wrap bytes in BytesIO for nio upload
-            image_file = BytesIO(image_data)
-            image_file.seek(0)  # Ensure we're at the start
-            file_size = len(image_data)
+            logger.info("Image validated: %d bytes, type: %s", file_size, content_type)
 
-            logger.info(f"Image validated: {file_size} bytes, type: {content_type}")
+            # Rewind on every call so nio's 429/timeout retries resend the
+            # whole image
+            def upload_data(got_429, got_timeouts):
+                buffer.seek(0)
+                return buffer
 
-            # Upload to Matrix
+            # Upload outside the download's timeout, so a slow or
+            # rate-limited homeserver doesn't cut the upload short
             upload_response, _ = await client.upload(
-                image_file,
+                upload_data,
                 content_type=content_type,
                 filename=f"{artist_name}.png",
                 filesize=file_size,
             )
 
             logger.info(
-                f"Upload response type: {type(upload_response)}, response: {upload_response}"
+                "Upload response type: %s, response: %s",
+                type(upload_response),
+                upload_response,
             )
 
             if isinstance(upload_response, UploadError):
-                logger.error(f"Failed to upload image: {upload_response.message}")
+                logger.error("Failed to upload image: %s", upload_response.message)
                 return
 
             if (
@@ -2058,44 +2236,41 @@ The token expires in 10 minutes.
                 or not upload_response.content_uri
             ):
                 logger.error(
-                    f"Failed to upload image to Matrix. Response: {upload_response}"
+                    "Failed to upload image to Matrix. Response: %s", upload_response
                 )
                 return
 
+            return upload_response.content_uri, content_type
+
+        except Exception as e:
+            logger.error("Error uploading image: %s", e, exc_info=True)
+            return None
+
+    async def _send_uploaded_image(
+        self, room: MatrixRoom, uploaded: tuple, artist_name: str, client: AsyncClient
+    ):
+        """Send an image returned by _upload_image to the room."""
+        content_uri, content_type = uploaded
+        try:
             # Send the image message with mxc:// URI
             await client.room_send(
                 room_id=room.room_id,
                 message_type="m.room.message",
                 content={
                     "msgtype": "m.image",
-                    "url": upload_response.content_uri,
+                    "url": content_uri,
                     "body": f"{artist_name}.png",
                     "info": {
                         "mimetype": content_type,
                     },
                 },
             )
-            logger.info(
-                f"Successfully uploaded and sent image: {upload_response.content_uri}"
-            )
+            logger.info("Successfully uploaded and sent image: %s", content_uri)
 
         except Exception as e:
-            logger.error(f"Error sending image: {e}", exc_info=True)
+            logger.error("Error sending image: %s", e, exc_info=True)
 
     @staticmethod
     def _markdown_to_html(text: str) -> str:
         """Convert basic markdown to HTML."""
-        # Links - must be before bold/italic to avoid conflicts
-        text = re.sub(r"\[(.+?)\]\((.+?)\)", r'<a href="\2">\1</a>', text)
-        # Bold
-        text = re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", text)
-        # Italic
-        text = re.sub(r"\*(.+?)\*", r"<em>\1</em>", text)
-        # Code - escape HTML entities inside code blocks so <username> etc. render
-        def _code_replace(m):
-            inner = m.group(1).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-            return f"<code>{inner}</code>"
-        text = re.sub(r"`(.+?)`", _code_replace, text)
-        # Newlines
-        text = text.replace("\n", "<br/>")
-        return text
+        return _RE_MARKDOWN.sub(_markdown_replace, text)
@@ -1,155 +1,279 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import re
+from typing import Optional
 
 from nio import AsyncClient, MatrixRoom
 
 logger = logging.getLogger(__name__)
 
 
+# How a subcommand handler is called
+_SENDER_ARGS = 0  # handler(room, sender, args, client)
+_ARGS = 1  # handler(room, args, client)
+_SENDER = 2  # handler(room, sender, client)
+_BARE = 3  # handler(room, client)
+
+# Splits a command's arguments into whitespace-separated tokens without
+# slicing the message
+_TOKEN_RE = re.compile(r"\S+")
+
+# Shortest unambiguous prefix accepted in place of a full command name
+_MIN_PREFIX_LEN = 3
+
+
+class _CommandTrie:
+    """Prefix tree over command names, used to expand unambiguous prefixes."""
+
+    __slots__ = ("_root",)
+
+    def __init__(self, names):
+        self._root: dict = {}
+        for name in names:
+            node = self._root
+            for char in name:
+                node = node.setdefault(char, {})
+            # None marks the end of a name and holds the full name
+            node[None] = name
+
+    def complete(self, prefix: str) -> Optional[str]:
+        """Return the only name starting with prefix, or None if there isn't one."""
+        node = self._root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return None
+        # Follow the branch down as long as it doesn't fork
+        while len(node) == 1:
+            key, child = next(iter(node.items()))
+            if key is None:
+                return child
+            node = child
+        return None
+
+
 class CommandRouterMixin:
+    # Normalized Last.fm subcommand -> (handler name, call style)
+    LASTFM_SUBCOMMANDS = {
+        "help": ("show_help", _BARE),
+        "link": ("link_user", _SENDER_ARGS),
+        "authcomplete": ("complete_auth_flow", _SENDER),
+        "sessionkey": ("set_session_key", _SENDER_ARGS),
+        "stats": ("show_stats", _SENDER_ARGS),
+        "topalbums": ("show_top_albums", _SENDER_ARGS),
+        "topartists": ("show_top_artists", _SENDER_ARGS),
+        "toptracks": ("show_top_tracks", _SENDER_ARGS),
+        "recent": ("show_recent_tracks", _SENDER_ARGS),
+        "track": ("show_track_info", _ARGS),
+        "love": ("love_track_command", _SENDER_ARGS),
+        "unlove": ("unlove_track_command", _SENDER_ARGS),
+        "loved": ("show_loved_tracks", _SENDER_ARGS),
+        "whoknows": ("who_knows", _SENDER_ARGS),
+        "whoknowstrack": ("who_knows_track", _SENDER_ARGS),
+        "whoknowsalbum": ("who_knows_album", _SENDER_ARGS),
+        "chart": ("generate_chart", _SENDER_ARGS),
+        "leaderboard": ("show_leaderboard", _ARGS),
+        "spotify": ("show_spotify_link", _SENDER_ARGS),
+        "lyrics": ("show_lyrics", _SENDER_ARGS),
+    }
+
+    # Normalized Discogs subcommand -> (handler name, call style)
+    DISCOGS_SUBCOMMANDS = {
+        "help": ("show_discogs_help", _BARE),
+        "link": ("link_discogs_user", _SENDER_ARGS),
+        "stats": ("show_discogs_stats", _SENDER_ARGS),
+        "collection": ("show_discogs_collection", _SENDER_ARGS),
+        "wantlist": ("show_discogs_wantlist", _SENDER_ARGS),
+        "search": ("search_discogs", _ARGS),
+        "artist": ("show_discogs_artist", _ARGS),
+        "release": ("show_discogs_release", _ARGS),
+    }
+
+    # Normalized top-level command -> router method name
+    TOP_LEVEL_COMMANDS = {
+        "help": "_route_help",
+        "lastfm": "_route_lastfm",
+        "discogs": "_route_discogs",
+        "spotify": "_route_spotify",
+        "lyrics": "_route_lyrics",
+    }
+
+    # Expand unambiguous prefixes such as "topa" -> "topalbums"
+    _TOP_LEVEL_TRIE = _CommandTrie(TOP_LEVEL_COMMANDS)
+    _LASTFM_TRIE = _CommandTrie(LASTFM_SUBCOMMANDS)
+    _DISCOGS_TRIE = _CommandTrie(DISCOGS_SUBCOMMANDS)
+
     async def handle_command(
         self, room: MatrixRoom, sender: str, message: str, client: AsyncClient
     ):
         """Parse and handle command."""
+        # Match the prefix and the command token in one pass; bot.py filters on
+        # the prefix already, but other callers may not
+        first = self._command_re.match(message)
+        if first is None:
+            return
         try:
             # Parse command
-            logger.info(f"Raw message: '{message}'")
-            parts = message[len(self.config.command_prefix) :].split()
-            logger.info(f"Parts after split: {parts}")
-            if not parts:
-                return
+            logger.info("Raw message: %r", message)
 
-            command = self.normalize_command(parts[0].lower())
-            args = parts[1:]
-            logger.info(f"Normalized command: '{command}', args: {args}")
-
-            # Route to appropriate handler
-            if command == "help":
-                await self.show_help(room, client)
-            elif command == "lastfm":
-                if not args:
-                    await self.show_now_playing(room, sender, client)
-                elif self.normalize_command(args[0]) == "help":
-                    await self.show_help(room, client)
-                elif self.normalize_command(args[0]) == "link":
-                    await self.link_user(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "authcomplete":
-                    await self.complete_auth_flow(room, sender, client)
-                elif self.normalize_command(args[0]) == "sessionkey":
-                    await self.set_session_key(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "stats":
-                    await self.show_stats(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "topalbums":
-                    await self.show_top_albums(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "topartists":
-                    await self.show_top_artists(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "toptracks":
-                    await self.show_top_tracks(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "recent":
-                    await self.show_recent_tracks(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "track":
-                    await self.show_track_info(room, args[1:], client)
-                elif self.normalize_command(args[0]) == "love":
-                    await self.love_track_command(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "unlove":
-                    await self.unlove_track_command(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "loved":
-                    await self.show_loved_tracks(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "whoknows":
-                    await self.who_knows(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "whoknowstrack":
-                    await self.who_knows_track(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "whoknowsalbum":
-                    await self.who_knows_album(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "chart":
-                    await self.generate_chart(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "leaderboard":
-                    await self.show_leaderboard(room, args[1:], client)
-                elif self.normalize_command(args[0]) == "spotify":
-                    if not self.spotify:
-                        await self.send_message(
-                            room, "❌ Spotify integration is not configured.", client
-                        )
-                        return
-                    await self.show_spotify_link(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "lyrics":
-                    await self.show_lyrics(room, sender, args[1:], client)
-                else:
-                    await self.send_message(room, f"Unknown command: {args[0]}", client)
-            elif command == "discogs":
-                if not self.discogs:
-                    await self.send_message(
-                        room, "❌ Discogs integration is not configured.", client
-                    )
-                    return
-
-                if not args:
-                    await self.show_discogs_help(room, client)
-                elif self.normalize_command(args[0]) == "help":
-                    await self.show_discogs_help(room, client)
-                elif self.normalize_command(args[0]) == "link":
-                    await self.link_discogs_user(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "stats":
-                    await self.show_discogs_stats(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "collection":
-                    await self.show_discogs_collection(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "wantlist":
-                    await self.show_discogs_wantlist(room, sender, args[1:], client)
-                elif self.normalize_command(args[0]) == "search":
-                    await self.search_discogs(room, args[1:], client)
-                elif self.normalize_command(args[0]) == "artist":
-                    await self.show_discogs_artist(room, args[1:], client)
-                elif self.normalize_command(args[0]) == "release":
-                    await self.show_discogs_release(room, args[1:], client)
-                else:
-                    await self.send_message(
-                        room, f"Unknown Discogs command: {args[0]}", client
-                    )
-            elif command == "spotify":
-                if not self.spotify:
-                    await self.send_message(
-                        room, "❌ Spotify integration is not configured.", client
-                    )
-                    return
-
-                if not args:
-                    # No args - show now playing from Last.fm and search on Spotify
-                    await self.show_spotify_link(room, sender, [], client)
-                else:
-                    # Search for specific track
-                    await self.show_spotify_link(room, sender, args, client)
-            elif command == "lyrics":
-                if not args:
-                    # No args - get lyrics for now playing track
-                    await self.show_lyrics(room, sender, [], client)
-                else:
-                    # Search for specific lyrics
-                    await self.show_lyrics(room, sender, args, client)
-            else:
+            # Reject unknown commands before tokenizing the rest of the message
+            command, route = self._resolve_command(
+                self._root_handlers, self._TOP_LEVEL_TRIE, first.group(1)
+            )
+            if route is None:
                 await self.send_message(
                     room,
-                    f"Unknown command. Type `{self.config.command_prefix}fm help` for help.",
+                    f"Unknown command. Type `{self._prefix}fm help` for help.",
                     client,
                 )
+                return
+
+            args = _TOKEN_RE.findall(message, first.end())
+            logger.info("Normalized command: %r, args: %s", command, args)
+
+            # Route to appropriate handler
+            await route(room, sender, args, client)
 
         except Exception as e:
-            logger.error(f"Error handling command: {e}", exc_info=True)
+            logger.error("Error handling command: %s", e, exc_info=True)
             await self.send_message(room, f"Error processing command: {str(e)}", client)
 
+    def _build_dispatch_tables(self) -> tuple:
+        """Bind the command tables to this handler.
+
+        Returns (top-level, Last.fm, Discogs) dicts mapping a normalized
+        command to a callable taking (room, sender, args, client), so routing
+        is a single dict lookup per level.
+        """
+        root = {
+            command: getattr(self, name)
+            for command, name in self.TOP_LEVEL_COMMANDS.items()
+        }
+        return (
+            root,
+            self._bind_subcommands(self.LASTFM_SUBCOMMANDS),
+            self._bind_subcommands(self.DISCOGS_SUBCOMMANDS),
+        )
+
+    def _bind_subcommands(self, table: dict) -> dict:
+        """Adapt each handler in a subcommand table to (room, sender, args, client)."""
+        handlers = {}
+        for command, (name, style) in table.items():
+            handler = getattr(self, name)
+            if style == _SENDER_ARGS:
+                handlers[command] = handler
+            elif style == _ARGS:
+                handlers[command] = (
+                    lambda room, sender, args, client, h=handler: h(room, args, client)
+                )
+            elif style == _SENDER:
+                handlers[command] = (
+                    lambda room, sender, args, client, h=handler: h(room, sender, client)
+                )
+            else:
+                handlers[command] = (
+                    lambda room, sender, args, client, h=handler: h(room, client)
+                )
+        return handlers
+
+    def _resolve_command(
+        self, handlers: dict, trie: _CommandTrie, token: str
+    ) -> tuple:
+        """Return (command, handler) for a token, or (command, None) if unknown.
+
+        Aliases are resolved first; a token that is neither an alias nor a
+        command name may still be an unambiguous prefix of one.
+        """
+        command = self.normalize_command(token)
+        handler = handlers.get(command)
+        if handler is None and len(command) >= _MIN_PREFIX_LEN:
+            full = trie.complete(command)
+            if full is not None:
+                return full, handlers[full]
+        return command, handler
+
+    async def _route_help(
+        self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
+    ):
+        await self.show_help(room, client)
+
+    async def _route_lastfm(
+        self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
+    ):
+        if not args:
+            await self.show_now_playing(room, sender, client)
+            return
+
+        subcommand, handler = self._resolve_command(
+            self._lastfm_handlers, self._LASTFM_TRIE, args[0]
+        )
+        if handler is None:
+            await self.send_message(room, f"Unknown command: {args[0]}", client)
+            return
+        if subcommand == "spotify" and not self.spotify:
+            await self.send_message(
+                room, "❌ Spotify integration is not configured.", client
+            )
+            return
+        await handler(room, sender, args[1:], client)
+
+    async def _route_discogs(
+        self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
+    ):
+        if not self.discogs:
+            await self.send_message(
+                room, "❌ Discogs integration is not configured.", client
+            )
+            return
+
+        if not args:
+            await self.show_discogs_help(room, client)
+            return
+
+        _, handler = self._resolve_command(
+            self._discogs_handlers, self._DISCOGS_TRIE, args[0]
+        )
+        if handler is None:
+            await self.send_message(
+                room, f"Unknown Discogs command: {args[0]}", client
+            )
+            return
+        await handler(room, sender, args[1:], client)
+
+    async def _route_spotify(
+        self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
+    ):
+        if not self.spotify:
+            await self.send_message(
+                room, "❌ Spotify integration is not configured.", client
+            )
+            return
+
+        # No args shows now playing from Last.fm and searches it on Spotify;
+        # otherwise search for the given track
+        await self.show_spotify_link(room, sender, args, client)
+
+    async def _route_lyrics(
+        self, room: MatrixRoom, sender: str, args: list, client: AsyncClient
+    ):
+        # No args gets lyrics for the now playing track; otherwise search
+        await self.show_lyrics(room, sender, args, client)
+
     async def handle_reaction(
         self, room: MatrixRoom, event, sender: str, client: AsyncClient
     ):
         """Handle reaction events for pagination."""
         try:
-            logger.info(f"Reaction event received - sender: {sender}")
+            logger.info("Reaction event received - sender: %s", sender)
 
             # Get the event being reacted to from ReactionEvent
             reacted_event_id = event.reacts_to
             reaction_key = event.key
 
             logger.info(
-                f"Reacted event ID: {reacted_event_id}, Reaction key: {reaction_key}"
+                "Reacted event ID: %s, Reaction key: %s", reacted_event_id, reaction_key
             )
 
             if not reacted_event_id or not reaction_key:
@@ -158,8 +282,9 @@ class CommandRouterMixin:
 
             # Check if this is a paginated message
             pagination = self.pagination.get(reacted_event_id)
-            logger.info(f"Pagination state: {pagination}")
-            logger.info(f"All paginations: {list(self.pagination.paginations.keys())}")
+            logger.debug("Pagination state: %s", pagination)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("All paginations: %s", list(self.pagination.paginations))
 
             if not pagination:
                 logger.info("Not a paginated message, skipping")
@@ -168,7 +293,9 @@ class CommandRouterMixin:
             # Verify the reactor is the original user
             if sender != pagination["user_id"]:
                 logger.info(
-                    f"Reactor {sender} is not the original user {pagination['user_id']}, skipping"
+                    "Reactor %s is not the original user %s, skipping",
+                    sender,
+                    pagination["user_id"],
                 )
                 return
 
@@ -178,7 +305,10 @@ class CommandRouterMixin:
             new_page = current_page
 
             logger.info(
-                f"Current page: {current_page}, Total pages: {total_pages}, Reaction: {reaction_key}"
+                "Current page: %d, Total pages: %d, Reaction: %s",
+                current_page,
+                total_pages,
+                reaction_key,
             )
 
             if reaction_key == "⬅️" and current_page > 1:
@@ -186,71 +316,48 @@ class CommandRouterMixin:
             elif reaction_key == "➡️" and current_page < total_pages:
                 new_page = current_page + 1
             else:
-                logger.info(f"Reaction {reaction_key} not applicable for current page")
+                logger.info("Reaction %s not applicable for current page", reaction_key)
                 return
 
-            logger.info(f"Navigating to page {new_page}")
+            logger.info("Navigating to page %d", new_page)
 
             # Update page in memory
             self.pagination.update_page(reacted_event_id, new_page)
 
-            # Call the callback to generate new content
-            callback = pagination["callback"]
-            new_content = await callback(new_page)
+            # Generate the new content, unless the page was rendered before
+            new_content = await self.pagination.render_page(pagination, new_page)
 
             # Delete the old message
-            import asyncio
-
             try:
                 await client.room_redact(room.room_id, reacted_event_id)
-                logger.info(f"Deleted message {reacted_event_id}")
+                logger.info("Deleted message %s", reacted_event_id)
             except Exception as e:
-                logger.warning(f"Could not delete message: {e}")
+                logger.warning("Could not delete message: %s", e)
 
             await asyncio.sleep(0.1)
 
             # Send new message with fresh reactions
             new_event_id = await self.send_message(room, new_content, client)
-            logger.info(f"Sent new message {new_event_id}")
+            logger.info("Sent new message %s", new_event_id)
 
             if new_event_id:
                 # Update pagination to track new message
                 if reacted_event_id in self.pagination.paginations:
                     old_pagination = self.pagination.paginations.pop(reacted_event_id)
-                    self.pagination.paginations[new_event_id] = {
-                        "room_id": old_pagination["room_id"],
-                        "user_id": old_pagination["user_id"],
-                        "current_page": new_page,
-                        "total_pages": old_pagination["total_pages"],
-                        "callback": old_pagination["callback"],
-                        "reaction_event_ids": [],
-                    }
+                    # Re-registering also restarts the entry's age
+                    self.pagination.register(
+                        new_event_id,
+                        old_pagination["room_id"],
+                        old_pagination["user_id"],
+                        new_page,
+                        old_pagination["total_pages"],
+                        old_pagination["callback"],
+                        old_pagination["page_cache"],
+                    )
 
                 # Add fresh reactions
-                await asyncio.sleep(0.1)
-                await client.room_send(
-                    room_id=room.room_id,
-                    message_type="m.reaction",
-                    content={
-                        "m.relates_to": {
-                            "rel_type": "m.annotation",
-                            "event_id": new_event_id,
-                            "key": "⬅️",
-                        }
-                    },
-                )
-                await client.room_send(
-                    room_id=room.room_id,
-                    message_type="m.reaction",
-                    content={
-                        "m.relates_to": {
-                            "rel_type": "m.annotation",
-                            "event_id": new_event_id,
-                            "key": "➡️",
-                        }
-                    },
-                )
-                logger.info(f"Added fresh reactions to {new_event_id}")
+                self._queue_pagination_reactions(room, new_event_id, client)
+                logger.info("Queued fresh reactions for %s", new_event_id)
 
         except Exception as e:
-            logger.error(f"Error handling reaction: {e}", exc_info=True)
+            logger.error("Error handling reaction: %s", e, exc_info=True)
@@ -60,6 +60,8 @@ class Config:
         # Last.fm Configuration
         self.lastfm_api_key = _get("LASTFM_API_KEY", file_config)
         self.lastfm_api_secret = _get("LASTFM_API_SECRET", file_config)
+        # Max concurrent per-user Last.fm requests in whoknows/leaderboard
+        self.lastfm_concurrency = int(_get("LASTFM_CONCURRENCY", file_config, "8"))
 
         # Discogs Configuration
         self.discogs_user_token = _get("DISCOGS_USER_TOKEN", file_config)
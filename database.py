@@ -4,25 +4,35 @@ Database management for user Last.fm mappings and cached data
 
 import logging
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Callable, Optional
 import aiosqlite
 
 logger = logging.getLogger(__name__)
 
+# Number of cache/token writes after which an early cleanup is requested
+CACHE_CLEANUP_THRESHOLD = 500
+
 
 class Database:
     """SQLite database for storing user mappings and stats."""
 
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, on_cache_full: Optional[Callable[[], None]] = None):
         self.db_path = db_path
         self.db: aiosqlite.Connection = None
+        # Cache rows written since the last clear_all_old() run
+        self.pending_cache_writes = 0
+        self._on_cache_full = on_cache_full
 
     async def init(self):
         """Initialize the database with required tables."""
         self.db = await aiosqlite.connect(self.db_path)
 
-        await self.db.execute("PRAGMA journal_mode = WAL")
-        await self.db.execute("PRAGMA synchronous = NORMAL")
+        # WAL lets command lookups read while the cache cleanup writes; it is
+        # persistent, so it only needs setting on file-backed databases.
+        if self.db_path != ":memory:":
+            await self.db.execute("PRAGMA journal_mode = WAL")
+            await self.db.execute("PRAGMA synchronous = NORMAL")
+        await self.db.execute("PRAGMA busy_timeout = 30000")
         await self.db.execute("PRAGMA temp_store = MEMORY")
 
         # Create tables
@@ -87,6 +97,11 @@ class Database:
         # Run migrations
         await self._migrate_database()
 
+        # Give the planner statistics from the first query rather than after
+        # the first daily optimize; analysis_limit keeps this cheap on large tables
+        await self.db.execute("PRAGMA analysis_limit = 1000")
+        await self.db.execute("PRAGMA optimize")
+
     async def _migrate_database(self):
         """Run database migrations."""
         try:
@@ -111,6 +126,11 @@ class Database:
     async def close(self):
         """Close the database connection."""
         if self.db:
+            try:
+                # SQLite recommends running optimize just before closing
+                await self.db.execute("PRAGMA optimize")
+            except Exception as e:
+                logger.warning("PRAGMA optimize on close failed: %s", e)
             await self.db.close()
 
     async def link_user(self, matrix_user_id: str, lastfm_username: str) -> bool:
@@ -220,6 +240,7 @@ class Database:
             (lastfm_username, stats_json)
         )
         await self.db.commit()
+        self._note_cache_write()
 
     async def get_cached_stats(self, lastfm_username: str, max_age_hours: int = 1) -> str:
         """Get cached stats if they're fresh enough."""
@@ -241,17 +262,6 @@ class Database:
 
         return row[0]
 
-    async def clear_old_cache(self, max_age_hours: int = 24):
-        """Clear stats cache older than max_age_hours."""
-        await self.db.execute(
-            """
-            DELETE FROM stats_cache
-            WHERE cached_at < datetime('now', '-' || ? || ' hours')
-            """,
-            (max_age_hours,)
-        )
-        await self.db.commit()
-
     async def cache_playcount(self, lastfm_username: str, item_type: str, item_name: str,
                               playcount: int, artist_name: str = None):
         """Cache a playcount for an artist/track/album."""
@@ -264,6 +274,7 @@ class Database:
             (lastfm_username, item_type, item_name.lower(), artist_name.lower() if artist_name else None, playcount)
         )
         await self.db.commit()
+        self._note_cache_write()
 
     async def get_cached_playcount(self, lastfm_username: str, item_type: str, item_name: str,
                                    artist_name: str = None, max_age_hours: int = 1) -> Optional[int]:
@@ -291,16 +302,30 @@ class Database:
 
         return row[0]
 
-    async def clear_old_playcount_cache(self, max_age_hours: int = 24):
-        """Clear playcount cache older than max_age_hours."""
-        await self.db.execute(
-            """
-            DELETE FROM playcount_cache
-            WHERE cached_at < datetime('now', '-' || ? || ' hours')
+    async def get_cached_playcounts(self, lastfm_usernames: list, item_type: str, item_name: str,
+                                    artist_name: str = None, max_age_hours: int = 1) -> dict:
+        """Get fresh cached playcounts for several users in one query."""
+        if not lastfm_usernames:
+            return {}
+        placeholders = ','.join(['?' for _ in lastfm_usernames])
+        artist_key = artist_name.lower() if artist_name else None
+        cursor = await self.db.execute(
+            f"""
+            SELECT lastfm_username, playcount, cached_at FROM playcount_cache
+            WHERE lastfm_username IN ({placeholders})
+              AND item_type = ?
+              AND item_name = ?
+              AND (artist_name = ? OR (artist_name IS NULL AND ? IS NULL))
             """,
-            (max_age_hours,)
+            (*lastfm_usernames, item_type, item_name.lower(), artist_key, artist_key)
         )
-        await self.db.commit()
+        rows = await cursor.fetchall()
+
+        cutoff = datetime.now() - timedelta(hours=max_age_hours)
+        return {
+            row[0]: row[1] for row in rows
+            if datetime.fromisoformat(row[2]) >= cutoff
+        }
 
     async def store_auth_token(self, matrix_user_id: str, auth_token: str) -> bool:
         """Store a pending auth token for a user."""
@@ -314,6 +339,7 @@ class Database:
                 (matrix_user_id, auth_token)
             )
             await self.db.commit()
+            self._note_cache_write()
             return True
         except Exception as e:
             logger.error(f"Error storing auth token: {e}")
@@ -344,16 +370,31 @@ class Database:
             logger.error(f"Error deleting auth token: {e}")
             return False
 
-    async def clear_old_auth_tokens(self, max_age_hours: int = 24):
-        """Clear auth tokens older than max_age_hours."""
-        await self.db.execute(
-            """
-            DELETE FROM auth_tokens
-            WHERE created_at < datetime('now', '-' || ? || ' hours')
-            """,
-            (max_age_hours,)
-        )
+    def _note_cache_write(self):
+        """Count a cache write and request an early cleanup past the threshold."""
+        self.pending_cache_writes += 1
+        if self.pending_cache_writes == CACHE_CLEANUP_THRESHOLD and self._on_cache_full:
+            self._on_cache_full()
+
+    async def clear_all_old(self, max_age_hours: int = 24):
+        """Clear stats cache, playcount cache and auth tokens older than max_age_hours."""
+        # The connection is shared by every coroutine, so no explicit
+        # BEGIN/rollback here: that would fail inside another coroutine's
+        # open transaction and roll back its pending write
+        for table, column in (
+            ("stats_cache", "cached_at"),
+            ("playcount_cache", "cached_at"),
+            ("auth_tokens", "created_at"),
+        ):
+            await self.db.execute(
+                f"""
+                DELETE FROM {table}
+                WHERE {column} < datetime('now', '-' || ? || ' hours')
+                """,
+                (max_age_hours,)
+            )
         await self.db.commit()
+        self.pending_cache_writes = 0
 
     async def optimize(self):
         """Run SQLite maintenance to reduce bloat and improve query planning."""
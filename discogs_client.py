@@ -14,19 +14,22 @@ BASE_URL = "https://api.discogs.com"
 class DiscogsClient:
     """Client for interacting with Discogs API."""
 
-    def __init__(self, user_token: str):
+    def __init__(self, user_token: str, session: Optional[aiohttp.ClientSession] = None):
         self.user_token = user_token
-        self.session: Optional[aiohttp.ClientSession] = None
+        # An injected session is shared with the caller, who is responsible for closing it
+        self.session: Optional[aiohttp.ClientSession] = session
+        self._owns_session = session is None
 
     async def get_session(self) -> aiohttp.ClientSession:
         """Get or create aiohttp session."""
         if self.session is None:
             self.session = aiohttp.ClientSession()
+            self._owns_session = True
         return self.session
 
     async def close(self):
-        """Close the session."""
-        if self.session:
+        """Close the session (only if this client created it)."""
+        if self.session and self._owns_session:
             await self.session.close()
 
     async def _request(self, endpoint: str, params: Dict = None) -> Optional[Dict]:
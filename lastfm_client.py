@@ -12,24 +12,35 @@ logger = logging.getLogger(__name__)
 
 BASE_URL = "https://ws.audioscrobbler.com/2.0"
 
+# Longest Retry-After wait honoured for a rate-limited request
+MAX_RETRY_AFTER = 5.0
+
 
 class LastfmClient:
     """Client for interacting with Last.fm API."""
 
-    def __init__(self, api_key: str, api_secret: str):
+    def __init__(
+        self,
+        api_key: str,
+        api_secret: str,
+        session: Optional[aiohttp.ClientSession] = None,
+    ):
         self.api_key = api_key
         self.api_secret = api_secret
-        self.session: Optional[aiohttp.ClientSession] = None
+        # An injected session is shared with the caller, who is responsible for closing it
+        self.session: Optional[aiohttp.ClientSession] = session
+        self._owns_session = session is None
 
     async def get_session(self) -> aiohttp.ClientSession:
         """Get or create aiohttp session."""
         if self.session is None:
             self.session = aiohttp.ClientSession()
+            self._owns_session = True
         return self.session
 
     async def close(self):
-        """Close the session."""
-        if self.session:
+        """Close the session (only if this client created it)."""
+        if self.session and self._owns_session:
             await self.session.close()
 
     async def _request(self, params: Dict) -> Optional[Dict]:
@@ -50,6 +61,8 @@ class LastfmClient:
                     if resp.status in {429, 500, 502, 503, 504}:
                         if attempt < max_attempts - 1:
                             backoff = (0.5 * (2 ** attempt)) + random.uniform(0, 0.2)
+                            if resp.status == 429:
+                                backoff = max(backoff, self._retry_after(resp))
                             logger.warning(
                                 "Last.fm API retryable error %s, retrying in %.2fs",
                                 resp.status,
@@ -60,7 +73,14 @@ class LastfmClient:
 
                     logger.error(f"Last.fm API error: {resp.status}")
                     return None
-            except Exception as e:
+            except (aiohttp.ContentTypeError, ValueError) as e:
+                # A non-JSON or malformed body (e.g. an HTML error page) would
+                # fail the same way again. Caught before ClientError, which
+                # ContentTypeError subclasses
+                logger.error(f"Invalid Last.fm API response: {e}")
+                return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Connection problems and timeouts are worth another attempt
                 if attempt < max_attempts - 1:
                     backoff = (0.5 * (2 ** attempt)) + random.uniform(0, 0.2)
                     logger.warning("Last.fm API exception, retrying in %.2fs: %s", backoff, e)
@@ -68,9 +88,22 @@ class LastfmClient:
                     continue
                 logger.error(f"Error calling Last.fm API: {e}")
                 return None
+            except Exception as e:
+                # Anything else is unexpected; don't retry it
+                logger.error(f"Error calling Last.fm API: {e}")
+                return None
 
         return None
 
+    @staticmethod
+    def _retry_after(resp: aiohttp.ClientResponse) -> float:
+        """Seconds the server asked us to wait, capped at MAX_RETRY_AFTER."""
+        try:
+            return min(float(resp.headers.get("Retry-After", 0)), MAX_RETRY_AFTER)
+        except ValueError:
+            # HTTP-date form; fall back to the regular backoff
+            return 0.0
+
     async def get_user_info(self, username: str) -> Optional[Dict]:
         """Get user info from Last.fm."""
         data = await self._request({
@@ -13,23 +13,28 @@ logger = logging.getLogger(__name__)
 
 BASE_URL = "https://lrclib.net/api"
 USER_AGENT = "fmatrix/0.1.0 (https://github.com/zerw0/fmatrix)"
+# Sent per request so the client works on a shared session too
+HEADERS = {"User-Agent": USER_AGENT}
 
 
 class LyricsClient:
     """Client for fetching lyrics from lrclib.net."""
 
-    def __init__(self) -> None:
-        self.session: Optional[aiohttp.ClientSession] = None
+    def __init__(self, session: Optional[aiohttp.ClientSession] = None) -> None:
+        # A shared session may be injected; it's then closed by its owner
+        self.session = session
+        self._owns_session = session is None
 
     async def _get_session(self) -> aiohttp.ClientSession:
         """Get or create aiohttp session."""
         if self.session is None or self.session.closed:
-            self.session = aiohttp.ClientSession(headers={"User-Agent": USER_AGENT})
+            self.session = aiohttp.ClientSession()
+            self._owns_session = True
         return self.session
 
     async def close(self) -> None:
-        """Close the underlying HTTP session."""
-        if self.session and not self.session.closed:
+        """Close the session (only if this client created it)."""
+        if self.session and self._owns_session and not self.session.closed:
             await self.session.close()
 
     # ------------------------------------------------------------------
@@ -82,6 +87,7 @@ class LyricsClient:
             async with session.get(
                 f"{BASE_URL}/get",
                 params=params,
+                headers=HEADERS,
                 timeout=aiohttp.ClientTimeout(total=10),
             ) as resp:
                 if resp.status == 404:
@@ -117,6 +123,7 @@ class LyricsClient:
             async with session.get(
                 f"{BASE_URL}/search",
                 params={"q": query},
+                headers=HEADERS,
                 timeout=aiohttp.ClientTimeout(total=10),
             ) as resp:
                 if resp.status != 200:
@@ -69,10 +69,7 @@ async def main(config_path=None):
     health_task = asyncio.create_task(health_check_loop())
 
     try:
-        # Initialize database
-        await bot.init_db()
-
-        # Start the bot
+        # Start the bot (initializes the database before connecting)
         run_result = await bot.run()
         if run_result is False:
             health_task.cancel()
@@ -90,9 +87,21 @@ async def main(config_path=None):
         sys.exit(1)
 
 
+def _install_event_loop_policy():
+    """Use uvloop's libuv-backed event loop when it is available."""
+    try:
+        import uvloop
+    except ImportError:
+        logger.debug("uvloop not installed; using the default asyncio event loop")
+        return
+    uvloop.install()
+    logger.info("Using uvloop event loop")
+
+
 def run():
     """Entry point for the fmatrix console script."""
     args = _parse_args()
+    _install_event_loop_policy()
     asyncio.run(main(config_path=args.config))
 
 